@@ -0,0 +1,243 @@
+import contextvars
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+import httpx
+import openai
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
+from cache import request_key
+from context import count_tokens, estimate_tokens
+import prompts
+
+FAKE_PHRASES = [
+    'Я пока присматриваюсь ко всем, но кое-кто ведёт себя подозрительно тихо.',
+    'Мне кажется, нам стоит внимательнее послушать тех, кто молчит.',
+    'Я мирный житель и хочу, чтобы город победил. Давайте рассуждать спокойно.',
+    'Вчерашние слова некоторых игроков не сходятся с их поведением.',
+]
+
+NARRATOR_ANSWERS = {
+    prompts.START_NIGHT: prompts.NIGHT_TEMPLATE,
+    prompts.START_DISCUSSION: prompts.DISCUSSION_TEMPLATE,
+    prompts.START_VOTING: prompts.VOTING_TEMPLATE,
+}
+
+
+# Кто отправляет запрос. Кассета хранит его рядом с ответом: одинаковые запросы разных игроков
+# (например, общий системный промпт) при воспроизведении получают каждый свой ответ, в каком бы порядке ни пришли.
+current_caller: contextvars.ContextVar[str | None] = contextvars.ContextVar('current_caller', default=None)
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+def make_completion(model: str, content: str, messages: list[dict]) -> ChatCompletion:
+    prompt_tokens = count_tokens(messages)
+    completion_tokens = estimate_tokens(content)
+    return ChatCompletion(
+        id=f'fake-{time.time_ns()}',
+        object='chat.completion',
+        created=int(time.time()),
+        model=model or 'fake',
+        choices=[
+            Choice(
+                index=0,
+                finish_reason='stop',
+                message=ChatCompletionMessage(role='assistant', content=content),
+            )
+        ],
+        usage=CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ),
+    )
+
+
+def stream_chunks(completion: ChatCompletion, delay: float = 0.0, include_usage: bool = False):
+    # Разбивает готовый ответ на чанки по словам, как это делает настоящий потоковый API
+    content = completion.choices[0].message.content or ''
+    words = content.split(' ')
+    for i, word in enumerate(words):
+        if delay:
+            time.sleep(delay)
+        yield ChatCompletionChunk(
+            id=completion.id,
+            object='chat.completion.chunk',
+            created=completion.created,
+            model=completion.model,
+            choices=[
+                ChunkChoice(
+                    index=0,
+                    delta=ChoiceDelta(content=word if i == 0 else f' {word}'),
+                    finish_reason='stop' if i == len(words) - 1 else None,
+                )
+            ],
+        )
+    if include_usage:
+        yield ChatCompletionChunk(
+            id=completion.id,
+            object='chat.completion.chunk',
+            created=completion.created,
+            model=completion.model,
+            choices=[],
+            usage=completion.usage,
+        )
+
+
+def scripted_answer(messages: list[dict], rng: random.Random, **params) -> str:
+    # Простейший «игрок»: если просят имя - называет одно из упомянутых в разговоре имён, иначе говорит общую фразу
+    response_format = params.get('response_format')
+    if response_format and response_format.get('type') == 'json_schema':
+        names = response_format['json_schema']['schema']['properties']['name']['enum']
+        return json.dumps({'name': rng.choice(names)}, ensure_ascii=False)
+    last = messages[-1]['content']
+    if messages[0]['content'] == prompts.SUMMARIZE:
+        return 'Ничего важного не произошло.'
+    if last in NARRATOR_ANSWERS:
+        return NARRATOR_ANSWERS[last]
+    if 'ИМЯ' in last.upper():
+        text = '\n'.join(message['content'] for message in messages)
+        names = [name for name in prompts.PLAYER_NAMES if name in text]
+        if names:
+            return rng.choice(names)
+    return rng.choice(FAKE_PHRASES)
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class _Chat:
+    def __init__(self, create):
+        self.completions = _Completions(create)
+
+
+class FakeClient:
+    # Клиент без сети с интерфейсом OpenAI: отвечает по сценарию с искусственной задержкой
+    def __init__(self, responder=None, latency: float = 0.0, jitter: float = 0.0, seed: int | None = None, error_rate: float = 0.0,
+                 retry_after: float | None = None):
+        self.responder = responder if responder is not None else scripted_answer
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        # Доля запросов, на которые отвечаем 429, как перегруженный провайдер
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chat = _Chat(self._create)
+
+    def _create(self, model: str, messages: list[dict], stream: bool = False, stream_options: dict | None = None, **params):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            rate_limited = self.rng.random() < self.error_rate
+        if rate_limited:
+            headers = {'retry-after': str(self.retry_after)} if self.retry_after is not None else {}
+            response = httpx.Response(429, headers=headers, request=httpx.Request('POST', 'http://fake/chat/completions'))
+            raise openai.RateLimitError('Rate limit exceeded', response=response, body=None)
+        # При потоковой выдаче задержка приходится на первый токен, остальные идут быстро
+        if delay:
+            time.sleep(delay)
+        # Ответ зависит только от запроса и seed, а не от того, в каком порядке потоки дошли до клиента
+        rng = random.Random(f'{self.seed}:{request_key(model, messages, **params)}')
+        content = self.responder(messages, rng, **params)
+        completion = make_completion(model, content, messages)
+        if stream:
+            return stream_chunks(completion, delay / 20, bool(stream_options and stream_options.get('include_usage')))
+        return completion
+
+    def close(self):
+        pass
+
+
+class RecordingClient:
+    # Пишет каждый запрос и ответ в кассету JSONL, передавая вызов настоящему клиенту
+    def __init__(self, inner, path: str):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+        self.chat = _Chat(self._create)
+
+    def _create(self, model: str, messages: list[dict], **params):
+        completion = self.inner.chat.completions.create(model=model, messages=messages, **params)
+        if params.get('stream'):
+            return self._record_stream(completion, model, messages, params)
+        self._write(model, messages, params, completion)
+        return completion
+
+    def _record_stream(self, stream, model: str, messages: list[dict], params: dict):
+        # Потоковый ответ записывается целиком (или до места, где его оборвали) одной обычной записью
+        parts = []
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk
+        finally:
+            stream.close()
+            completion = make_completion(model, ''.join(parts), messages)
+            if usage is not None:
+                completion.usage = usage
+            self._write(model, messages, params, completion)
+
+    def _write(self, model: str, messages: list[dict], params: dict, completion: ChatCompletion):
+        record = {
+            'key': request_key(model, messages, **params),
+            'caller': current_caller.get(),
+            'model': model,
+            'params': params,
+            'messages': messages,
+            'response': completion.model_dump(mode='json'),
+        }
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.inner.close()
+
+
+class ReplayClient:
+    # Отдаёт ответы из кассеты, не обращаясь к сети. Одинаковые запросы получают записанные ответы по очереди.
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.responses: dict[tuple[str | None, str], deque] = defaultdict(deque)
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    self.responses[record.get('caller'), record['key']].append(record['response'])
+        self.chat = _Chat(self._create)
+
+    def _create(self, model: str, messages: list[dict], **params) -> ChatCompletion:
+        key = request_key(model, messages, **params)
+        with self._lock:
+            # Кассеты, записанные без caller, ищутся только по ключу
+            queue = self.responses.get((current_caller.get(), key)) or self.responses.get((None, key))
+            if not queue:
+                raise CassetteMissError(f'No recorded response for request {key}')
+            response = queue.popleft() if len(queue) > 1 else queue[0]
+        completion = ChatCompletion.model_validate(response)
+        if params.get('stream'):
+            return stream_chunks(completion, include_usage=bool(params.get('stream_options', {}).get('include_usage')))
+        return completion
+
+    def close(self):
+        pass
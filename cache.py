@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import get_config
+
+
+def request_key(model: str, messages: list[dict], **params) -> str:
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CompletionCache:
+    # Два уровня: LRU в памяти процесса и SQLite на диске, общий для всех процессов
+    def __init__(self, path: str, max_bytes: int, memory_items: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        self._db.commit()
+        # Размер кэша считается один раз при открытии и дальше ведётся на каждой записи
+        self.total = self._total()
+        # Время обращения к записям с диска обновляется пачкой, а не отдельной записью на каждое чтение
+        self.accessed: dict[str, float] = {}
+        self.accessed_flushed = time.monotonic()
+
+    def _total(self) -> int:
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def _flush_accessed(self):
+        if self.accessed:
+            self._db.executemany('UPDATE cache SET accessed = ? WHERE key = ?', [(accessed, key) for key, accessed in self.accessed.items()])
+            self.accessed.clear()
+        self.accessed_flushed = time.monotonic()
+
+    def _touch(self, key: str):
+        self.accessed[key] = time.time()
+        if len(self.accessed) >= 64 or time.monotonic() - self.accessed_flushed >= 5:
+            self._flush_accessed()
+            self._db.commit()
+
+    def _remember(self, key: str, value: str):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            if key in self.memory:
+                # Горячие записи отвечают из памяти, но время обращения нужно и диску, иначе их вытеснят первыми
+                self.memory.move_to_end(key)
+                self._touch(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return self.memory[key]
+            row = self._db.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._touch(key)
+            self.hits += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._remember(key, value)
+            size = len(key) + len(value.encode())
+            row = self._db.execute('SELECT size FROM cache WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)', (key, value, size, time.time()))
+            self.total += size - (row[0] if row is not None else 0)
+            self._flush_accessed()
+            if self.total > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # Кэш общий для процессов, поэтому перед чисткой точный размер пересчитывается
+        total = self.total = self._total()
+        if total <= self.max_bytes:
+            return
+        # Удаляем самые давно использованные записи с запасом, чтобы не чистить кэш на каждой записи
+        target = self.max_bytes * 0.9
+        stale = []
+        for key, size in self._db.execute('SELECT key, size FROM cache ORDER BY accessed'):
+            if total <= target:
+                break
+            stale.append((key,))
+            total -= size
+        self._db.executemany('DELETE FROM cache WHERE key = ?', stale)
+        self.evictions += len(stale)
+        self.total = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._db.commit()
+            self._db.close()
+
+
+_lock = threading.Lock()
+_cache: CompletionCache | None = None
+_cache_pid: int | None = None
+
+
+def get_cache() -> CompletionCache | None:
+    global _cache, _cache_pid
+    config = get_config()
+    # При записи кассеты кэш выключен, иначе попавшие в кэш запросы не будут записаны. При воспроизведении он не нужен.
+    if not config.cache or config.record or config.backend == 'replay':
+        return None
+    with _lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = CompletionCache(config.cache_path, config.cache_size_mb * 1024 * 1024, config.cache_memory_items)
+            _cache_pid = os.getpid()
+        return _cache
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+from events import Event
+
+logger = logging.getLogger(__name__)
+
+
+def dump_event(event: Event) -> list:
+    audience = sorted(event.audience) if event.audience is not None else None
+    return [event.role, event.content, event.speaker, audience, event.excluded, event.pinned]
+
+
+def load_event(data: list) -> Event:
+    role, content, speaker, audience, excluded, pinned = data
+    return Event(role, content, speaker, frozenset(audience) if audience is not None else None, excluded, pinned)
+
+
+class Checkpoint:
+    # Снимки игры на границах фаз. Файл JSONL только дописывается: запись содержит события, появившиеся после
+    # прошлого снимка, и текущее состояние. Недописанная последняя строка (падение во время записи) отбрасывается.
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.cursor = 0
+        if not resume:
+            open(path, 'w').close()
+
+    def save(self, stage: str, events: list[Event], state: dict):
+        fresh = events[self.cursor:]
+        record = {'stage': stage, 'events': [dump_event(event) for event in fresh], 'state': state}
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+        self.cursor += len(fresh)
+        logger.info(f'Снимок игры [{stage}]: +{len(fresh)} событий, {len(line)} байт')
+
+    def load(self) -> tuple[str, list[Event], dict]:
+        events = []
+        stage = state = None
+        valid = 0
+        with open(self.path, 'rb') as file:
+            for line in file:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('нет конца строки')
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f'{self.path}: повреждённый хвост после {valid} байт отброшен')
+                    break
+                events.extend(load_event(data) for data in record['events'])
+                stage = record['stage']
+                state = record['state']
+                valid += len(line)
+        if state is None:
+            raise ValueError(f'В {self.path} нет ни одного снимка игры')
+        # Следующий снимок допишется сразу за последней целой записью
+        os.truncate(self.path, valid)
+        self.cursor = len(events)
+        return stage, events, state
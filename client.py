@@ -0,0 +1,87 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from openai import OpenAI
+from backends import FakeClient, RecordingClient, ReplayClient
+from config import get_config
+
+_lock = threading.Lock()
+_client = None
+_client_pid: int | None = None
+_executor: ThreadPoolExecutor | None = None
+_executor_pid: int | None = None
+
+
+def _create_openai_client() -> OpenAI:
+    config = get_config()
+    http_client = httpx.Client(
+        http2=config.http2,
+        limits=httpx.Limits(
+            max_connections=config.pool_size,
+            max_keepalive_connections=config.pool_size,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+        timeout=config.timeout,
+    )
+    return OpenAI(
+        base_url=config.url,
+        api_key=config.api_key,
+        http_client=http_client,
+        # Повторами занимается scheduler.Scheduler
+        max_retries=0,
+    )
+
+
+def _create_client():
+    config = get_config()
+    match config.backend:
+        case 'openai':
+            client = _create_openai_client()
+        case 'fake':
+            client = FakeClient(latency=config.fake_latency, jitter=config.fake_jitter, seed=config.fake_seed, error_rate=config.fake_error_rate)
+        case 'replay':
+            return ReplayClient(config.cassette)
+        case _:
+            raise ValueError(f'Unknown LLM backend: {config.backend}')
+    if config.record:
+        client = RecordingClient(client, config.cassette)
+    return client
+
+
+def set_client(client):
+    # Подмена клиента, например FakeClient со своим сценарием для тестов и замеров
+    global _client, _client_pid
+    with _lock:
+        _client = client
+        _client_pid = os.getpid()
+
+
+def get_client():
+    # Один клиент (и один пул соединений) на процесс. После fork дочерний процесс создаёт свой.
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = _create_client()
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_executor() -> ThreadPoolExecutor:
+    # Пул потоков для асинхронных запросов. Число одновременных запросов ограничивает планировщик, а пул намеренно
+    # больше: иначе срочные запросы ждали бы в FIFO-очереди пула за фоновыми и до очереди с приоритетами не доходили.
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=get_config().max_concurrency * 8, thread_name_prefix='llm')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
@@ -0,0 +1,74 @@
+import os
+from functools import cache
+from dotenv import load_dotenv
+
+
+class Config:
+    def __init__(self):
+        load_dotenv()
+        self.api_key = os.environ.get('OPENROUTER_API')
+        self.url = os.environ.get('URL')
+        self.model = os.environ.get('MODEL')
+        self.pool_size = int(os.environ.get('POOL_SIZE', 20))
+        self.keepalive_expiry = float(os.environ.get('KEEPALIVE_EXPIRY', 120))
+        self.http2 = os.environ.get('HTTP2', '1') == '1'
+        self.timeout = float(os.environ.get('TIMEOUT', 120))
+        self.max_concurrency = int(os.environ.get('MAX_CONCURRENCY', 8))
+        self.token_budget = int(os.environ.get('TOKEN_BUDGET', 6000))
+        self.context_window = int(os.environ.get('CONTEXT_WINDOW', 24))
+        self.retrieval_k = int(os.environ.get('RETRIEVAL_K', 6))
+        self.embedder = os.environ.get('EMBEDDER', 'hashing')
+        self.embedding_model = os.environ.get('EMBEDDING_MODEL')
+        self.narration = os.environ.get('NARRATION', '1') == '1'
+        self.cache = os.environ.get('CACHE', '1') == '1'
+        self.cache_path = os.environ.get('CACHE_PATH', 'cache.sqlite')
+        self.cache_size_mb = int(os.environ.get('CACHE_SIZE_MB', 256))
+        self.cache_memory_items = int(os.environ.get('CACHE_MEMORY_ITEMS', 1024))
+        self.backend = os.environ.get('LLM_BACKEND', 'openai')
+        self.record = os.environ.get('RECORD', '0') == '1'
+        self.cassette = os.environ.get('CASSETTE', 'cassette.jsonl')
+        self.fake_latency = float(os.environ.get('FAKE_LATENCY', 0))
+        self.fake_jitter = float(os.environ.get('FAKE_JITTER', 0))
+        self.fake_seed = int(os.environ.get('FAKE_SEED', 0))
+        self.stream = os.environ.get('STREAM', '1') == '1'
+        self.structured_output = os.environ.get('STRUCTURED_OUTPUT', '1') == '1'
+        self.name_retries = int(os.environ.get('NAME_RETRIES', 2))
+        self.rpm = float(os.environ.get('RPM', 0))
+        self.tpm = float(os.environ.get('TPM', 0))
+        self.target_latency = float(os.environ.get('TARGET_LATENCY', 30))
+        self.max_retries = int(os.environ.get('MAX_RETRIES', 4))
+        self.backoff_base = float(os.environ.get('BACKOFF_BASE', 1))
+        self.backoff_max = float(os.environ.get('BACKOFF_MAX', 30))
+        self.breaker_threshold = int(os.environ.get('BREAKER_THRESHOLD', 5))
+        self.breaker_cooldown = float(os.environ.get('BREAKER_COOLDOWN', 30))
+        self.fake_error_rate = float(os.environ.get('FAKE_ERROR_RATE', 0))
+        self.idle_timeout = float(os.environ.get('IDLE_TIMEOUT', 300))
+        self.session_timeout = float(os.environ.get('SESSION_TIMEOUT', 3600))
+        self.max_sessions = int(os.environ.get('MAX_SESSIONS', 500))
+        self.metrics_json = os.environ.get('METRICS_JSON')
+        self.metrics_prometheus = os.environ.get('METRICS_PROMETHEUS')
+        self.routes = {
+            'narration': os.environ.get('MODEL_NARRATION'),
+            'setup': os.environ.get('MODEL_SETUP'),
+            'discussion': os.environ.get('MODEL_DISCUSSION'),
+            'voting': os.environ.get('MODEL_VOTING'),
+            'summary': os.environ.get('MODEL_SUMMARY'),
+            'end': os.environ.get('MODEL_END'),
+        }
+        self.routes_file = os.environ.get('ROUTES_FILE')
+        self.fallback_model = os.environ.get('FALLBACK_MODEL')
+        self.fallback_timeout = float(os.environ.get('FALLBACK_TIMEOUT', 0))
+        self.log_dir = os.environ.get('LOG_DIR', 'logs')
+        self.log_level = os.environ.get('LOG_LEVEL', 'INFO')
+        self.log_max_mb = int(os.environ.get('LOG_MAX_MB', 50))
+        self.log_backups = int(os.environ.get('LOG_BACKUPS', 5))
+        self.log_compress = os.environ.get('LOG_COMPRESS', '0') == '1'
+        self.log_batch = int(os.environ.get('LOG_BATCH', 256))
+        self.log_flush_interval = float(os.environ.get('LOG_FLUSH_INTERVAL', 1))
+        self.transcripts = os.environ.get('TRANSCRIPTS', '1') == '1'
+        self.transcript_dir = os.environ.get('TRANSCRIPT_DIR', os.path.join(self.log_dir, 'transcripts'))
+
+
+@cache
+def get_config() -> Config:
+    return Config()
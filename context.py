@@ -0,0 +1,68 @@
+from events import Event
+
+
+def estimate_tokens(text: str) -> int:
+    # Грубая оценка без токенизатора: для русского текста ~3 символа на токен, плюс служебные токены сообщения
+    return len(text) // 3 + 4
+
+
+def count_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(message['content']) for message in messages)
+
+
+def build_context(events: list[Event], summary_cursor: int, summary: str, token_budget: int, recalled: list[Event] = (), window: int | None = None) -> list[dict]:
+    pinned = [event.as_message() for event in events[:summary_cursor] if event.pinned]
+    if summary:
+        pinned.append(
+            {
+                'role': 'system',
+                'content': f'Краткое содержание прошлых событий игры:\n{summary}',
+            }
+        )
+    budget = token_budget - count_tokens(pinned)
+    start = summary_cursor
+    # Окно включается, только когда вся история не помещается в бюджет: ровно в этом случае её сворачивает compact,
+    # иначе выпавшие из окна события не попали бы ни в конспект, ни в контекст
+    if window is not None and sum(estimate_tokens(event.content) for event in events[summary_cursor:]) > budget:
+        start = max(summary_cursor, len(events) - window)
+    budget -= sum(estimate_tokens(event.content) for event in recalled)
+    recent = [event for event in events[summary_cursor:start] if event.pinned] + events[start:]
+    budget -= sum(estimate_tokens(event.content) for event in recent if event.pinned)
+    kept = []
+    full = False
+    # Скользящее окно: идём с конца и берём свежие сообщения, пока хватает бюджета. Последнее сообщение берём всегда.
+    for event in reversed(recent):
+        if not event.pinned:
+            tokens = estimate_tokens(event.content)
+            if full or (kept and tokens > budget):
+                full = True
+                continue
+            budget -= tokens
+        kept.append(event)
+    kept.reverse()
+    kept_ids = {id(event) for event in kept}
+    recalled = [event for event in recalled if id(event) not in kept_ids]
+    messages = pinned + [event.as_message() for event in kept]
+    if recalled:
+        # Вспомненные события ставим сразу после закреплённых промптов, перед свежими сообщениями
+        position = len(pinned) + next((i for i, event in enumerate(kept) if not event.pinned), len(kept))
+        messages.insert(
+            position,
+            {
+                'role': 'system',
+                'content': f'Возможно, важные прошлые события:\n{format_events(recalled)}',
+            }
+        )
+    return messages
+
+
+def format_events(events: list[Event]) -> str:
+    lines = []
+    for event in events:
+        if event.role == 'assistant':
+            lines.append(f'Ты: {event.content}')
+        elif event.speaker:
+            lines.append(f'{event.speaker}: {event.content}')
+        else:
+            lines.append(event.content)
+    return '\n'.join(lines)
@@ -0,0 +1,83 @@
+import sys
+import threading
+from collections.abc import Sequence
+
+
+class Event:
+    __slots__ = ('role', 'content', 'speaker', 'audience', 'excluded', 'pinned')
+
+    def __init__(self, role: str, content: str, speaker: str | None = None, audience: frozenset[str] | None = None, excluded: str | None = None, pinned: bool = False):
+        self.role = role
+        self.content = sys.intern(content)
+        self.speaker = speaker
+        # audience=None - сообщение видят все, кроме excluded
+        self.audience = audience
+        self.excluded = excluded
+        # закреплённые сообщения (системные промпты, правила) никогда не вытесняются из контекста
+        self.pinned = pinned
+
+    def visible_to(self, viewer: str) -> bool:
+        if viewer == self.excluded:
+            return False
+        return self.audience is None or viewer in self.audience
+
+    def as_message(self) -> dict:
+        return {
+            'role': self.role,
+            'content': self.content,
+        }
+
+
+class EventLog:
+    def __init__(self, on_append=None):
+        self.events: list[Event] = []
+        self._lock = threading.Lock()
+        # Вызывается для каждого нового события, например чтобы записать его в стенограмму
+        self.on_append = on_append
+
+    def append(self, event: Event):
+        with self._lock:
+            self.events.append(event)
+        if self.on_append is not None:
+            self.on_append(event)
+
+    def __len__(self):
+        return len(self.events)
+
+
+class MemoryView(Sequence):
+    def __init__(self, log: EventLog, owner):
+        self.log = log
+        self.owner = owner
+        self._indices: list[int] = []
+        self._cursor = 0
+        # Память может читаться одновременно из хода объекта и из фонового сворачивания
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        with self._lock:
+            events = self.log.events
+            end = len(events)
+            viewer = self.owner.name
+            for i in range(self._cursor, end):
+                if events[i].visible_to(viewer):
+                    self._indices.append(i)
+            self._cursor = end
+
+    def append(self, message: dict, pinned: bool = False):
+        speaker = self.owner.name if message['role'] == 'assistant' else None
+        self.log.append(Event(message['role'], message['content'], speaker, audience=frozenset([self.owner.name]), pinned=pinned))
+
+    def events(self, start: int = 0) -> list[Event]:
+        self._sync()
+        return [self.log.events[i] for i in self._indices[start:]]
+
+    def __getitem__(self, index):
+        self._sync()
+        if isinstance(index, slice):
+            return [self.log.events[i].as_message() for i in self._indices[index]]
+        return self.log.events[self._indices[index]].as_message()
+
+    def __len__(self):
+        self._sync()
+        return len(self._indices)
@@ -0,0 +1,196 @@
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+import shutil
+import time
+from config import get_config
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(process)d %(name)s %(message)s'
+
+transcript_logger = logging.getLogger('transcript')
+
+
+def gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class BatchFileHandler(logging.handlers.RotatingFileHandler):
+    # Пишет в файл пачками: на диск строки уходят при заполнении буфера, раз в interval секунд
+    # или сразу, если пришло предупреждение. Старые файлы по желанию сжимаются в .gz.
+    def __init__(self, filename: str, max_bytes: int = 0, backups: int = 0, compress: bool = False, capacity: int = 256, interval: float = 1.0):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer: list[str] = []
+        self.flushed = time.monotonic()
+        if compress:
+            self.namer = lambda name: name + '.gz'
+            self.rotator = gzip_rotator
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.capacity or record.levelno >= logging.WARNING or time.monotonic() - self.flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                text = ''.join(self.buffer)
+                self.buffer.clear()
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes and self.stream.tell() + len(text) >= self.maxBytes:
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                self.stream.write(text)
+                self.stream.flush()
+            self.flushed = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        # FileHandler.close сбрасывает буфер, только если файл уже открыт
+        self.flush()
+        super().close()
+
+
+class TranscriptHandler(logging.Handler):
+    # Раскладывает записи стенограммы по файлам игр <game_id>.jsonl. Файл открывается только на время записи пачки,
+    # поэтому тысячи одновременных игр не держат тысячи дескрипторов.
+    def __init__(self, directory: str, compress: bool = False, capacity: int = 256, interval: float = 1.0):
+        super().__init__()
+        self.directory = directory
+        self.compress = compress
+        self.capacity = capacity
+        self.interval = interval
+        self.buffers: dict[str, list[str]] = {}
+        self.flushed = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, game_id: str) -> str:
+        return os.path.join(self.directory, f'{game_id}.jsonl' + ('.gz' if self.compress else ''))
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            buffer = self.buffers.setdefault(record.game_id, [])
+            buffer.append(json.dumps(record.entry, ensure_ascii=False) + '\n')
+            if len(buffer) >= self.capacity or record.final:
+                self._write(record.game_id)
+            if time.monotonic() - self.flushed >= self.interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def _write(self, game_id: str):
+        lines = self.buffers.pop(game_id, None)
+        if not lines:
+            return
+        # Каждая пачка дописывается отдельным членом gzip, такой файл читается gzip.open целиком
+        opener = gzip.open if self.compress else open
+        with opener(self.path(game_id), 'at', encoding='utf-8') as file:
+            file.write(''.join(lines))
+
+    def flush(self):
+        self.acquire()
+        try:
+            for game_id in list(self.buffers):
+                self._write(game_id)
+            self.flushed = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    # Если новых записей нет interval секунд, сбрасывает буферы обработчиков, чтобы ничего не зависало в памяти
+    def __init__(self, records, *handlers, interval: float = 1.0):
+        super().__init__(records, *handlers)
+        self.interval = interval
+
+    def dequeue(self, block: bool):
+        while True:
+            try:
+                return self.queue.get(block, self.interval if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+
+class Transcript:
+    # Стенограмма одной игры: кто, в какой фазе, кому и что сказал, и сколько шёл каждый запрос к модели.
+    # Запись только кладётся в очередь, на диск её пишет поток QueueListener.
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        self.started = time.perf_counter()
+        self.closed = False
+
+    def write(self, kind: str, final: bool = False, **fields):
+        if not transcript_logger.isEnabledFor(logging.INFO):
+            return
+        entry = {'game_id': self.game_id, 't': round(time.perf_counter() - self.started, 3), 'kind': kind, **fields}
+        transcript_logger.info(kind, extra={'game_id': self.game_id, 'entry': entry, 'final': final})
+
+    def close(self, **fields):
+        # Закрыть можно и из обработчика ошибки: повторный вызов ничего не пишет
+        if self.closed:
+            return
+        self.closed = True
+        self.write('end', final=True, **fields)
+
+
+def setup_logging(name: str) -> FlushingQueueListener:
+    # Игровые потоки только кладут записи в очередь, форматирование и запись на диск идут в отдельном потоке
+    config = get_config()
+    os.makedirs(config.log_dir, exist_ok=True)
+    file_handler = BatchFileHandler(
+        os.path.join(config.log_dir, f'{name}.log'),
+        config.log_max_mb * 1024 * 1024,
+        config.log_backups,
+        config.log_compress,
+        config.log_batch,
+        config.log_flush_interval,
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    file_handler.addFilter(lambda record: not hasattr(record, 'entry'))
+    handlers = [file_handler]
+    if config.transcripts:
+        transcript_handler = TranscriptHandler(config.transcript_dir, config.log_compress, config.log_batch, config.log_flush_interval)
+        transcript_handler.addFilter(lambda record: hasattr(record, 'entry'))
+        handlers.append(transcript_handler)
+        transcript_logger.setLevel(logging.INFO)
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(config.log_level)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener = FlushingQueueListener(records, *handlers, interval=config.log_flush_interval)
+    listener.start()
+
+    def stop():
+        if listener._thread is None:
+            return
+        listener.stop()
+        for handler in handlers:
+            handler.close()
+
+    atexit.register(stop)
+    # Воркеры ProcessPoolExecutor завершаются без atexit, но финализаторы multiprocessing у них вызываются
+    multiprocessing.util.Finalize(listener, stop, exitpriority=10)
+    return listener
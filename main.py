@@ -1,90 +1,289 @@
-import os
 from abc import ABC
+import argparse
+import asyncio
+from collections.abc import Callable
+from functools import partial
+import math
 import random
-from openai import OpenAI
+import time
+import uuid
+import openai
 # from huggingface_hub import InferenceClient
-from dotenv import load_dotenv
+from backends import current_caller
+from cache import get_cache, request_key
+from checkpoint import Checkpoint
+from client import get_client, get_executor
+from config import get_config
+from context import build_context, count_tokens, format_events
+from events import Event, EventLog, MemoryView
+from logs import Transcript, setup_logging
+from metrics import get_registry
+from pipeline import Speculation
+from protocol import ask_name
+from retrieval import RetrievalMemory, create_embedder
+from routing import Tier, get_router
+from rules import Roles, assign_names, assign_roles, parse_role, role_name, sheriff_check, winner
+from scheduler import Priority, get_scheduler, is_retriable
+from seats import ConsoleSeat
 import prompts
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class Roles:
-    CIVILIAN = 1
-    SHERIFF = 2
-    MAFIA = 3
-    DON_MAFIA = 4
-
-
 class BaseNeuroObject(ABC):
-    def __init__(self):
-        load_dotenv()
-        api_key = os.environ.get('OPENROUTER_API')
-        url = os.environ.get('URL')
-        self.client = OpenAI(
-            base_url=url,
-            api_key=api_key,
-        )
+    phase = ''
+    priority = Priority.NORMAL
+    tier = Tier.DISCUSSION
+    transcript: Transcript | None = None
+
+    def __init__(self, name: str = '', events: EventLog | None = None, model: str | None = None):
+        self.name = name
+        self.events = events if events is not None else EventLog()
+        self.client = get_client()
         # self.client = InferenceClient(
         #     provider='auto',
         #     api_key=api_key,
         # )
-        self.model = os.environ.get('MODEL')
-        self.memory = []
+        config = get_config()
+        self.model = model or config.model
+        # Явно заданная модель (например, в турнире, где сравниваются модели) важнее маршрутизации по классам запросов
+        self.model_pinned = model is not None
+        self.usage = {
+            'calls': 0,
+            'cached_calls': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+        }
+        self.memory = MemoryView(self.events, self)
+        self.token_budget = config.token_budget
+        self.context_window = config.context_window
+        self.summary = ''
+        self.summary_cursor = 0
+        self.retrieval: RetrievalMemory | None = None
+        self.retrieval_k = config.retrieval_k
+        self.retrieval_cursor = 0
+
+    def _complete(self, messages: list[dict], temperature: float = 0.0, presence_penalty: float = 0.0, cache: bool | None = None,
+                  echo: str | None = None, stop: Callable[[str], bool] | None = None, response_format: dict | None = None,
+                  priority: int | None = None, tier: str | None = None) -> str:
+        started = time.perf_counter()
+        tier = tier or self.tier
+        router = get_router()
+        model = self.model if self.model_pinned else router.model(tier, self.model)
+        priority = self.priority if priority is None else priority
+        current_caller.set(self.name)
+        params = {
+            'temperature': temperature,
+            'presence_penalty': presence_penalty,
+        }
+        if response_format is not None:
+            params['response_format'] = response_format
+        # По умолчанию кэшируются только детерминированные запросы (temperature=0)
+        completion_cache = get_cache() if (temperature == 0.0 if cache is None else cache) else None
+        if completion_cache is not None:
+            key = request_key(model, messages, **params)
+            answer = completion_cache.get(key)
+            if answer is not None:
+                self.usage['cached_calls'] += 1
+                get_registry().record_call(self.name, self.phase, time.perf_counter() - started, cached=True, tier=tier, model=model)
+                if echo is not None:
+                    self.output(f'{echo}{answer}')
+                return answer
+        timeout = router.timeout(model)
+        try:
+            (answer, usage, ttft, stopped), retries = self._submit(model, messages, params, started, echo, stop, priority, timeout)
+        except openai.APITimeoutError:
+            if timeout is None:
+                raise
+            # Основная модель не уложилась в FALLBACK_TIMEOUT, запрос уходит запасной
+            logger.warning(f'{self.name} [{self.phase}]: {model} не ответила за {router.fallback_timeout} с, запрос передан {router.fallback}')
+            get_registry().increment('llm_fallback_total', caller=self.name, phase=self.phase, tier=tier, model=model)
+            model = router.fallback
+            (answer, usage, ttft, stopped), retries = self._submit(model, messages, params, started, echo, stop, priority)
+        latency = time.perf_counter() - started
+        prompt_tokens = usage.prompt_tokens if usage is not None else 0
+        completion_tokens = usage.completion_tokens if usage is not None else 0
+        self.usage['calls'] += 1
+        self.usage['prompt_tokens'] += prompt_tokens
+        self.usage['completion_tokens'] += completion_tokens
+        get_registry().record_call(self.name, self.phase, latency, prompt_tokens, completion_tokens, retries, ttft, tier=tier, model=model)
+        logger.info('%s [%s]: %s -> %s, %.2f с, токенов %d+%d', self.name, self.phase, tier, model, latency, prompt_tokens, completion_tokens)
+        if self.transcript is not None:
+            self.transcript.write('call', phase=self.phase, speaker=self.name, tier=tier, model=model, latency=round(latency, 3),
+                                  ttft=ttft and round(ttft, 3), prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, retries=retries)
+        # Оборванный ответ в кэш не кладём
+        if completion_cache is not None and not stopped:
+            completion_cache.put(key, answer)
+        return answer
+
+    def _submit(self, model: str, messages: list[dict], params: dict, started: float, echo: str | None, stop: Callable[[str], bool] | None,
+                priority: int, timeout: float | None = None) -> tuple:
+        retriable = is_retriable
+        if timeout is not None:
+            # Таймаут не повторяем на той же модели, а сразу отдаём запасной
+            params = {**params, 'timeout': timeout}
+            retriable = lambda error: not isinstance(error, openai.APITimeoutError) and is_retriable(error)
+        if get_config().stream and (echo is not None or stop is not None):
+            request = partial(self._stream, model, messages, params, started, echo, stop)
+        else:
+            request = partial(self._create, model, messages, params, echo)
+        return get_scheduler().submit(request, priority, count_tokens(messages), retriable)
+
+    def _create(self, model: str, messages: list[dict], params: dict, echo: str | None) -> tuple:
+        completion = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            **params,
+        )
+        answer = completion.choices[0].message.content
+        if echo is not None:
+            self.output(f'{echo}{answer}')
+        return answer, completion.usage, None, False
 
-    def send_message(self, message: str, role: str = 'user', temperature: float = 0.0, presence_penalty: float = 0.0) -> str:
+    def _stream(self, model: str, messages: list[dict], params: dict, started: float, echo: str | None, stop: Callable[[str], bool] | None) -> tuple:
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            **params,
+            stream=True,
+            stream_options={'include_usage': True},
+        )
+        parts = []
+        usage = None
+        ttft = None
+        stopped = False
+        if echo is not None:
+            self.output(echo, end='')
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                if echo is not None:
+                    self.output(delta, end='')
+                if stop is not None and stop(''.join(parts)):
+                    stopped = True
+                    break
+        finally:
+            stream.close()
+            if echo is not None:
+                self.output('')
+        return ''.join(parts), usage, ttft, stopped
+
+    def recall(self, events: list[Event], query: str) -> list[Event]:
+        # В индекс попадают только сообщения, вышедшие из окна свежих сообщений
+        boundary = len(events) - self.context_window
+        if boundary > self.retrieval_cursor:
+            ids = [i for i in range(self.retrieval_cursor, boundary) if not events[i].pinned]
+            self.retrieval.add([format_events([events[i]]) for i in ids], ids)
+            self.retrieval_cursor = boundary
+        found = self.retrieval.search([query], self.retrieval_k)[0]
+        return [events[i] for i in sorted(i for i, _ in found)]
+
+    def build_context(self, query: str | None = None) -> list[dict]:
+        events = self.memory.events()
+        if self.retrieval is None or not query:
+            return build_context(events, self.summary_cursor, self.summary, self.token_budget)
+        recalled = self.recall(events, query)
+        return build_context(events, self.summary_cursor, self.summary, self.token_budget, recalled, self.context_window)
+
+    def send_message(self, message: str, role: str = 'user', temperature: float = 0.0, presence_penalty: float = 0.0, pinned: bool | None = None,
+                     cache: bool | None = None, echo: str | None = None, stop: Callable[[str], bool] | None = None,
+                     response_format: dict | None = None, tier: str | None = None) -> str:
         self.memory.append(
             {
                 'role': role,
                 'content': message
-            }
-        )
-        completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.memory,
-            temperature=temperature,
-            presence_penalty=presence_penalty,
+            },
+            pinned=role == 'system' if pinned is None else pinned,
         )
+        answer = self._complete(self.build_context(message), temperature, presence_penalty, cache, echo, stop, response_format, tier=tier)
         self.memory.append(
             {
                 'role': 'assistant',
-                'content': completion.choices[0].message.content
+                'content': answer
             }
         )
-        logger.info(f'>>> {message}')
-        logger.info(f'<<< {completion.choices[0].message.content}')
-        return completion.choices[0].message.content
+        logger.debug('%s >>> %s', self.name, message)
+        logger.debug('%s <<< %s', self.name, answer)
+        return answer
+
+    def output(self, text: str, end: str = '\n'):
+        print(text, end=end, flush=True)
+
+    async def send_message_async(self, message: str, **kwargs) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), partial(self.send_message, message, **kwargs))
+
+    def compact(self):
+        # Вызывается после каждой завершённой фазы: старые события сворачиваются в конспект, свежие остаются как есть
+        events = self.memory.events()
+        keep_from = len(events) - self.context_window
+        if keep_from <= self.summary_cursor:
+            return
+        if count_tokens(build_context(events, self.summary_cursor, self.summary, math.inf)) <= self.token_budget:
+            return
+        folded = [event for event in events[self.summary_cursor:keep_from] if not event.pinned]
+        previous = self.summary or 'Пока пусто.'
+        self.summary = self._complete(
+            [
+                {'role': 'system', 'content': prompts.SUMMARIZE},
+                {'role': 'user', 'content': f'Предыдущий конспект:\n{previous}\n\nНовые события:\n{format_events(folded)}'},
+            ],
+            priority=Priority.BACKGROUND,
+            tier=Tier.SUMMARY,
+        )
+        self.summary_cursor = keep_from
+        logger.info(f'{self.name}: конспект обновлён, свёрнуто {len(folded)} сообщений')
+
+    async def compact_async(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_executor(), self.compact)
+
+    def snapshot(self) -> dict:
+        return {
+            'summary': self.summary,
+            'summary_cursor': self.summary_cursor,
+            'usage': self.usage,
+        }
+
+    def restore(self, state: dict):
+        # Индекс поиска по памяти не сохраняется: он заново строится из событий при первом recall
+        self.summary = state['summary']
+        self.summary_cursor = state['summary_cursor']
+        self.usage.update(state['usage'])
 
 
 class Player(BaseNeuroObject):
-    def __init__(self, game, name: str = '', alive: bool = True, role: int = 0, bot: bool = False):
-        super().__init__()
+    def __init__(self, game, name: str = '', alive: bool = True, role: int = 0, bot: bool = False, seat=None):
+        super().__init__(name, game.events, game.model if game.model_pinned else None)
         self.game = game
         self.alive = alive
         self.role = role
         self.bot = bot
-        self.name = name
+        self.seat = seat if seat is not None or bot else ConsoleSeat()
         if bot:
-            self.send_message(prompts.START + prompts.ROLES, role='system')
-            self.send_message(prompts.BOT_RULES.format(name=self.name.upper(), role=self.role), role='system')
+            config = get_config()
+            if config.retrieval_k > 0:
+                self.retrieval = RetrievalMemory(create_embedder(config.embedder, config.embedding_model))
+
+    async def brief(self):
+        # Системные промпты бота. Отдельно от __init__, чтобы всех ботов можно было подготовить параллельно.
+        await self.send_message_async(prompts.START + prompts.ROLES, role='system')
+        await self.send_message_async(prompts.BOT_RULES.format(name=self.name.upper(), role=self.role), role='system')
+
+    def output(self, text: str, end: str = '\n'):
+        self.game.output(text, end)
 
     def say_to_all(self, message: str):
-        print(f'Говорит {self.name}: {message}')
-        players = [player for player in self.game.players if player != self]
-        for player in players:
-            player.memory.append(
-                {
-                    'role': 'user',
-                    'content': message
-                }
-            )
-        self.game.memory.append(
-            {
-                'role': 'user',
-                'content': message
-            }
-        )
+        self.output(f'Говорит {self.name}: {message}')
+        self.events.append(Event('user', message, self.name, excluded=self.name))
 
     def say_to_narrator(self, message: str):
         message = f'Говорит {self.name}: {message}'
@@ -95,31 +294,125 @@ class Player(BaseNeuroObject):
             }
         )
 
-    def introduce(self):
+    async def introduce(self):
         if self.bot:
-            answer = self.send_message(
+            answer = await self.send_message_async(
                 'Теперь представься, расскажи о себе другим игрокам так, чтобы они не узнали твою роль, но при этом, '
                 'чтобы они доверяли тебе. Расскажи ту информацию о своей личности, которую считаешь нужной.', presence_penalty=0.7, temperature=0.2)
         else:
-            answer = input('Представьтесь и расскажите о себе:\n')
+            answer = await self.seat.ask('Представьтесь и расскажите о себе:\n')
         self.say_to_all(answer)
 
-    def do_step(self, message, **kwargs) -> str:
+    async def do_step_async(self, message, **kwargs) -> str:
         if self.bot:
-            return self.send_message(message, **kwargs)
+            return await self.send_message_async(message, **kwargs)
         else:
-            return input('Введите сообщение:\n')
+            return await self.seat.ask('Введите сообщение:\n')
+
+    @property
+    def phase(self) -> str:
+        return self.game.phase
+
+    @property
+    def tier(self) -> str:
+        return Tier.SETUP if self.phase == 'choose_roles' else Tier.DISCUSSION
+
+    @property
+    def transcript(self) -> Transcript:
+        return self.game.transcript
 
     def __str__(self):
         return f'Я {self.name}. Моя роль - {self.role}'
 
 
 class Game(BaseNeuroObject):
-    def __init__(self, players_count):
-        super().__init__()
+    tier = Tier.NARRATION
+
+    def __init__(self, players_count, seed: int | None = None, humans: int = 1, model: str | None = None, seats: list | None = None,
+                 checkpoint: Checkpoint | None = None, game_id: str | None = None):
+        super().__init__('Ведущий', model=model)
+        self.game_id = game_id or f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        self.transcript = Transcript(self.game_id)
+        self.events.on_append = self.transcribe
         self.players = []
+        self.seats = seats if seats is not None else [ConsoleSeat() for _ in range(humans)]
+        self.humans = len(self.seats)
+        self.round = 0
+        self.phase = 'choose_roles'
         self.end = False
+        self.winner = None
         self.players_count = players_count
+        self.rng = random.Random(seed)
+        self.narration = not get_router().templated(Tier.NARRATION)
+        self.last_killed = None
+        self.checkpoint = checkpoint
+        self.compaction: asyncio.Future | None = None
+        # Последняя пройденная граница фаз, с неё продолжается восстановленная игра
+        self.stage = None
+
+    @classmethod
+    def resume(cls, path: str, seats: list | None = None) -> 'Game':
+        checkpoint = Checkpoint(path, resume=True)
+        stage, events, state = checkpoint.load()
+        humans = sum(not player['bot'] for player in state['players'])
+        # Модель передаём, только если она была задана явно, иначе восстановленная игра потеряла бы маршрутизацию
+        model = state['model'] if state['model_pinned'] else None
+        game = cls(len(state['players']), humans=humans, model=model, seats=seats, checkpoint=checkpoint, game_id=state['game_id'])
+        game.events.events.extend(events)
+        game.restore(state)
+        game.stage = stage
+        logger.info(f'Игра восстановлена из {path}: раунд {game.round}, граница {stage}, событий {len(events)}')
+        return game
+
+    def snapshot(self) -> dict:
+        version, internal, gauss = self.rng.getstate()
+        return {
+            **super().snapshot(),
+            'game_id': self.game_id,
+            'model': self.model,
+            'model_pinned': self.model_pinned,
+            'round': self.round,
+            'phase': self.phase,
+            'end': self.end,
+            'winner': self.winner,
+            'last_killed': self.last_killed,
+            'rng': [version, internal, gauss],
+            'players': [
+                {'name': player.name, 'role': player.role, 'alive': player.alive, 'bot': player.bot, **player.snapshot()}
+                for player in self.players
+            ],
+        }
+
+    def restore(self, state: dict):
+        super().restore(state)
+        self.round = state['round']
+        self.phase = state['phase']
+        self.end = state['end']
+        self.winner = state['winner']
+        self.last_killed = state['last_killed']
+        version, internal, gauss = state['rng']
+        self.rng.setstate((version, tuple(internal), gauss))
+        seats = iter(self.seats)
+        self.players = []
+        for data in state['players']:
+            player = Player(self, data['name'], data['alive'], data['role'], data['bot'], None if data['bot'] else next(seats))
+            player.restore(data)
+            self.players.append(player)
+
+    def transcribe(self, event: Event):
+        audience = sorted(event.audience) if event.audience is not None else None
+        self.transcript.write('event', round=self.round, phase=self.phase, speaker=event.speaker, role=event.role,
+                              audience=audience, excluded=event.excluded, text=event.content)
+
+    def save(self, stage: str):
+        self.stage = stage
+        if self.checkpoint is not None:
+            self.checkpoint.save(stage, self.events.events, self.snapshot())
+
+    @property
+    def priority(self) -> int:
+        # Реплики ведущего на пути к живому игроку обслуживаются раньше фоновой работы ботов
+        return Priority.CRITICAL if self.humans else Priority.NORMAL
 
     def find_player_by_name(self, name: str, only_alive: bool = True) -> Player | None:
         for player in self.players:
@@ -133,15 +426,7 @@ class Game(BaseNeuroObject):
     def find_players_by_role(self, role: str | int, only_alive: bool = True) -> list[Player]:
         result = []
         if isinstance(role, str):
-            match role:
-                case 'Мирный':
-                    role = Roles.CIVILIAN
-                case 'Шериф':
-                    role = Roles.SHERIFF
-                case 'Мафия':
-                    role = Roles.MAFIA
-                case 'Дон':
-                    role = Roles.DON_MAFIA
+            role = parse_role(role)
         for player in self.players:
             if player.role == role:
                 if only_alive:
@@ -151,153 +436,249 @@ class Game(BaseNeuroObject):
                     result.append(player)
         return result
 
+    async def compact_memories(self):
+        # Конспекты пишутся, пока идёт следующая фаза, а не перед ней. Новое сворачивание ждёт окончания предыдущего.
+        await self.finish_compaction()
+        objects = [self] + [player for player in self.players if player.alive and player.bot]
+        self.compaction = asyncio.ensure_future(asyncio.gather(*[obj.compact_async() for obj in objects]))
+
+    async def finish_compaction(self):
+        if self.compaction is not None:
+            compaction, self.compaction = self.compaction, None
+            await compaction
+
+    def output(self, text: str, end: str = '\n'):
+        # Всё, что видит стол, уходит живым игрокам. Если их нет, печатаем в консоль.
+        humans = [player for player in self.players if not player.bot]
+        if not humans:
+            print(text, end=end, flush=True)
+        for player in humans:
+            player.seat.write(text + end)
+
     def say_to_player(self, player: Player, message: str):
-        player.memory.append(
-            {
-                'role': 'user',
-                'content': message,
-            }
-        )
+        self.events.append(Event('user', message, self.name, audience=frozenset([player.name])))
         if not player.bot:
-            print(message)
+            player.seat.write(message + '\n')
 
-    def say_to_all(self, message: str):
-        for player in self.players:
-            self.say_to_player(player, message)
+    def say_to_all(self, message: str, show: bool = True):
+        self.events.append(Event('user', message, self.name, audience=frozenset(player.name for player in self.players)))
+        if show:
+            for player in self.players:
+                if not player.bot:
+                    player.seat.write(message + '\n')
+
+    def alive_names(self, exclude: Player | None = None) -> list[str]:
+        return [player.name for player in self.players if player.alive and player is not exclude]
+
+    def prefetch(self, prompt: str, temperature: float = 0.2) -> Speculation | None:
+        # Реплика ведущего, которая зависит только от уже известного, генерируется, пока ходят игроки
+        return Speculation(self, prompt, temperature) if self.narration else None
 
-    def choose_roles(self):
+    async def narrate(self, prompt: str, template: str, temperature: float = 0.2, speculation: Speculation | None = None) -> str:
+        # Ведущий нужен только для художественного текста. Без него используется шаблонная фраза.
+        if speculation is not None:
+            return await speculation.result(echo='Ведущий говорит: ')
+        if self.narration:
+            return await self.send_message_async(prompt, temperature=temperature, echo='Ведущий говорит: ')
+        self.output(f'Ведущий говорит: {template}')
+        return template
+
+    async def choose_roles(self):
         print('start choose roles')
-        self.send_message(prompts.CHOOSE_ROLES, 'user')
-        for i in range(self.players_count):
-            correct = False
-            player = None
-            while not correct:
-                correct = True
-                bot = False if i == 0 else True
-                answer = self.send_message(f'Создай игрока {i + 1}', 'user')
-                name, role = answer.strip().split()
-                if not bot:
-                    name = input('Введите имя:\n')
-                    print(f'Ваша роль: {role}')
-                match role:
-                    case 'Мирный':
-                        role = Roles.CIVILIAN
-                    case 'Шериф':
-                        role = Roles.SHERIFF
-                    case 'Мафия':
-                        role = Roles.MAFIA
-                    case 'Дон':
-                        role = Roles.DON_MAFIA
-                    case _:
-                        correct = False
-                        self.send_message(
-                            'Неправильный формат ответа. Вспомни первое сообщение и отвечай только так, как там сказано. Формат ответа: <имя> <роль>. Два слова на русском языке.')
-                player = Player(self, name, True, role, bot)
-            self.players.append(player)
-        all_players = '\n'.join([f'Имя: {player.name} Роль: {player.role},' for player in self.players])
-        self.send_message(f'Больше игроков не будет.\nИтоговый список игроков: \n{all_players}', 'user')
+        self.phase = 'choose_roles'
+        names = assign_names(self.players_count, self.rng)
+        roles = assign_roles(self.players_count, self.rng)
+        for i, (name, role) in enumerate(zip(names, roles)):
+            bot = i >= self.humans
+            seat = None
+            if not bot:
+                seat = self.seats[i]
+                name = (await seat.ask('Введите имя:\n')).strip()
+                # Видимость событий определяется по имени, поэтому имя ведущего занять нельзя: иначе игрок видел бы его память
+                while not name or name.casefold() == self.name.casefold() or name in names[self.humans:] or self.find_player_by_name(name, only_alive=False):
+                    name = (await seat.ask('Это имя занято. Введите другое имя:\n')).strip()
+                seat.write(f'Ваша роль: {role_name(role)}\n')
+            self.players.append(Player(self, name, True, role, bot, seat))
+        await asyncio.gather(*[player.brief() for player in self.players if player.bot])
+        all_players = '\n'.join([f'Имя: {player.name} Роль: {role_name(player.role)},' for player in self.players])
+        self.memory.append(
+            {
+                'role': 'user',
+                'content': f'Итоговый список игроков: \n{all_players}',
+            },
+            pinned=True,
+        )
 
-    def night(self):
-        answer = self.send_message(prompts.START_NIGHT, temperature=0.1)
-        print(f'Ведущий: {answer}')
+    async def night(self):
+        self.phase = 'night'
+        answer = await self.narrate(prompts.START_NIGHT, prompts.NIGHT_TEMPLATE, temperature=0.1)
         # TODO: Выбор порядка ходом можно строго задать алгоритмом, а можно сгенерировать нейронкой???
-        first_order = self.find_players_by_role(2)
-        second_order = self.find_players_by_role(3)
-        third_order = self.find_players_by_role(4)
+        first_order = self.find_players_by_role(Roles.SHERIFF)
+        second_order = self.find_players_by_role(Roles.MAFIA)
+        third_order = self.find_players_by_role(Roles.DON_MAFIA)
+        mafia_prompt = 'Скажи, что сейчас должны проснуться мафия и дон. Они должны выбрать какого игрока убить. НЕ ПРИДУМЫВАЙ И НЕ ВЫБИРАЙ ИМЁН. Не выходи из роли рассказчика.'
+        don_prompt = 'Скажи, что сейчас дон должен выбрать игрока. НЕ ПРИДУМЫВАЙ И НЕ ВЫБИРАЙ ИМЁН. Не выходи из роли рассказчика.'
+        mafia_line = None
         if first_order:
             sheriff = first_order[0]
-            answer = self.send_message('Скажи, что сейчас должен проснуться шериф и проверить роль какого-то игрока. НЕ ПРИДУМЫВАЙ И НЕ ВЫБИРАЙ ИМЁН. Не выходи из роли рассказчика.', temperature=0.2)
-            print(f'Ведущий говорит: {answer}')
-            answer = sheriff.do_step(prompts.SHERIFF_WAKE_UP).strip().replace('.', '').split()[-1]
-            answer = 'Роль игрока, которого ты проверил:' + self.send_message(f'Скажи роль игрока {answer}.')
-            self.say_to_player(sheriff, answer)
-        if second_order or third_order:
+            await self.narrate('Скажи, что сейчас должен проснуться шериф и проверить роль какого-то игрока. НЕ ПРИДУМЫВАЙ И НЕ ВЫБИРАЙ ИМЁН. Не выходи из роли рассказчика.', prompts.SHERIFF_TEMPLATE)
+            # Ход шерифа ведущий не видит, поэтому следующую реплику можно готовить заранее
+            mafia_line = self.prefetch(mafia_prompt)
+            name = await ask_name(sheriff, prompts.SHERIFF_WAKE_UP, self.alive_names(exclude=sheriff))
+            target = self.find_player_by_name(name)
+            self.say_to_player(sheriff, f'Роль игрока, которого ты проверил: {sheriff_check(target)}')
+        if second_order and not third_order:
+            # Дон мог выбыть ночью, а не на голосовании
+            self.choose_new_don()
+            second_order = self.find_players_by_role(Roles.MAFIA)
+            third_order = self.find_players_by_role(Roles.DON_MAFIA)
+        if third_order:
             don = third_order[0]
-            answer = self.send_message('Скажи, что сейчас должны проснуться мафия и дон. Они должны выбрать какого игрока убить. НЕ ПРИДУМЫВАЙ И НЕ ВЫБИРАЙ ИМЁН. Не выходи из роли рассказчика.', temperature=0.2)
-            print(f'Ведущий говорит: {answer}')
-            for mafia in second_order:
-                answer = mafia.do_step(prompts.MAFIA_WAKE_UP)
-                self.say_to_player(don, answer)
-            answer = self.send_message('Скажи, что сейчас дон должен выбрать игрока. НЕ ПРИДУМЫВАЙ И НЕ ВЫБИРАЙ ИМЁН. Не выходи из роли рассказчика.', temperature=0.2)
-            print(f'Ведущий говорит: {answer}')
-            answer = don.do_step(prompts.MAFIA_WAKE_UP + '\nТеперь, Дон (ты), должен выбрать, кого убить. Ты можешь согласиться или нет с вариантом из прошлых сообщений. Скажи ТОЛЬКО ОДНО ИМЯ из списка живых игроков.').strip().replace('.', '').split()[-1]
-            target_to_kill = self.find_player_by_name(answer.strip().replace('.', ''))
+            await self.narrate(mafia_prompt, prompts.MAFIA_TEMPLATE, speculation=mafia_line)
+            don_line = self.prefetch(don_prompt)
+            names = await asyncio.gather(*[ask_name(mafia, prompts.MAFIA_WAKE_UP, self.alive_names(exclude=mafia)) for mafia in second_order])
+            for mafia, name in zip(second_order, names):
+                self.say_to_player(don, f'{mafia.name} предлагает убить игрока {name}')
+            await self.narrate(don_prompt, prompts.DON_TEMPLATE, speculation=don_line)
+            answer = await ask_name(
+                don,
+                prompts.MAFIA_WAKE_UP + '\nТеперь, Дон (ты), должен выбрать, кого убить. Ты можешь согласиться или нет с вариантом из прошлых сообщений. Скажи ТОЛЬКО ОДНО ИМЯ из списка живых игроков.',
+                self.alive_names(exclude=don),
+            )
+            target_to_kill = self.find_player_by_name(answer)
             don.say_to_narrator(f'Члены мафии решили убить игрока {answer}')
             target_to_kill.alive = False
+            self.last_killed = target_to_kill.name
 
-    def day(self):
-        answer = self.send_message('Наступает день, скажи об этом игрокам, не забудь добавить, что город просыпается. Подведи итог: кого убила мафия. НЕ ВЫДАВАЙ РОЛИ ИГРОКОВ.', temperature=0.2)
-        print(f'Ведущий говорит: {answer}')
-        self.say_to_all(answer)
-        answer = self.send_message(prompts.START_DISCUSSION)
-        for player in self.players:
-            if player.alive:
-                answer = player.do_step(answer, temperature=0.2)
-                self.say_to_all(f'{player.name} говорит: {answer}')
-        answer = self.send_message(prompts.START_VOTING)
-        print(f'Ведущий говорит: {answer}')
-        count_votings = dict([(player.name, 0) for player in self.players])
+    async def day(self):
+        self.phase = 'day'
+        answer = await self.narrate('Наступает день, скажи об этом игрокам, не забудь добавить, что город просыпается. Подведи итог: кого убила мафия. НЕ ВЫДАВАЙ РОЛИ ИГРОКОВ.', prompts.DAY_TEMPLATE.format(name=self.last_killed))
+        self.say_to_all(answer, show=False)
+        answer = await self.narrate(prompts.START_DISCUSSION, prompts.DISCUSSION_TEMPLATE, temperature=0.0)
+        # Обсуждение ведущий не слышит, так что приглашение к голосованию готовим, пока игроки говорят
+        voting_line = self.prefetch(prompts.START_VOTING, temperature=0.0)
         for player in self.players:
             if player.alive:
-                name = player.do_step(answer).strip().replace('.', '').split()[-1]
-                self.say_to_all(f'{player.name} говорит: {name}')
-                count_votings[name] += 1
+                # Если за столом есть человек, речь бота печатается по мере генерации
+                echo = f'{player.name} говорит: ' if self.humans and player.bot else None
+                answer = await player.do_step_async(answer, temperature=0.2, echo=echo)
+                self.say_to_all(f'{player.name} говорит: {answer}', show=echo is None)
+        answer = await self.narrate(prompts.START_VOTING, prompts.VOTING_TEMPLATE, temperature=0.0, speculation=voting_line)
+        count_votings = dict([(player.name, 0) for player in self.players if player.alive])
+        voters = [player for player in self.players if player.alive]
+        names = await asyncio.gather(*[ask_name(player, answer, self.alive_names(exclude=player)) for player in voters])
+        for player, name in zip(voters, names):
+            self.say_to_all(f'{player.name} говорит: {name}')
+            count_votings[name] += 1
         count_votings = sorted(count_votings.items(), key=lambda x: x[1], reverse=True)
-        if count_votings[0][1] == count_votings[1][1]:
+        if len(count_votings) > 1 and count_votings[0][1] == count_votings[1][1]:
             return
         target_to_exclude = self.find_player_by_name(count_votings[0][0])
         message = f'{target_to_exclude.name} исключён (убит) в ходе голосования.'
         self.say_to_all(message)
+        self.memory.append(
+            {
+                'role': 'user',
+                'content': message,
+            }
+        )
         target_to_exclude.alive = False
-        if target_to_exclude.role == Roles.DON_MAFIA:
+        if target_to_exclude.role == Roles.DON_MAFIA and self.find_players_by_role(Roles.MAFIA):
             self.choose_new_don()
 
-    def main_loop(self):
+    def check_end(self) -> bool:
+        self.winner = winner(self.players)
+        self.end = self.winner is not None
+        return self.end
+
+    async def main_loop(self):
         print('start game')
-        iteration = 1
         while not self.end:
-            self.night()
-            self.day()
-            iteration += 1
-            alive_players = [player for player in self.players if player.alive]
-            list_of_alive_players = 'Список живых игроков:\n'
-            for player in alive_players:
-                list_of_alive_players += f'Имя {player.name}  Роль {player.role}'
-            answer = self.send_message(f'{list_of_alive_players}. Проанализируй его и скажи, игра закончена? Ответь ТОЛЬКО ОДНО СЛОВО: "ДА" или "НЕТ".').strip().replace('.', '').split()[-1]
-            if answer == 'ДА':
-                self.end = True
-
-    def first_day(self):
+            # Игра, восстановленная после ночи, продолжается с дня того же раунда
+            if self.stage != 'night':
+                self.round += 1
+                await self.night()
+                # Последнюю фазу игры не сворачиваем: конспекты уже никому не понадобятся
+                if not self.check_end():
+                    await self.compact_memories()
+                self.save('night')
+                if self.end:
+                    break
+            await self.day()
+            if not self.check_end():
+                await self.compact_memories()
+            self.save('day')
+
+    async def first_day(self):
         print('start introducing')
+        self.phase = 'first_day'
         for player in self.players:
-            player.introduce()
+            await player.introduce()
         players_status = 'Итак, список всех игроков и их статус. Запомни этот список. В дальнейшем обращайся к игрокам только по их именам.'
         players_status += '\n'.join([f'Имя:{player.name} Живой:{player.alive}' for player in self.players])
         for player in self.players:
             if player.bot:
                 message = players_status.replace(player.name, f'{player.name} (Ты)')
                 self.say_to_player(player, message)
-        players_status = 'Итак, список всех игроков и их статус. Запомни этот список. В дальнейшем обращайся к игрокам только по их именам.'
-        players_status += '\n'.join(
-            [f'Имя:{player.name} Живой:{player.alive} Роль:{player.role}' for player in self.players])
-        self.send_message(players_status)
 
-    def end_game(self):
-        answer = self.send_message('Скажи, кто победил? Мирные или мафия? Ответь более подробно.', temperature=0.3)
-        print(f'Ведущий говорит: {answer}')
+    async def end_game(self):
+        self.phase = 'end_game'
+        if not get_router().templated(Tier.END):
+            await self.send_message_async(f'Игра окончена. Победили: {self.winner}. Расскажи игрокам, кто победил, более подробно.', temperature=0.3, echo='Ведущий говорит: ',
+                                          tier=Tier.END)
+        else:
+            self.output(f'Ведущий говорит: {prompts.END_TEMPLATE.format(winner=self.winner)}')
+        await self.finish_compaction()
+        completion_cache = get_cache()
+        if completion_cache is not None:
+            logger.info(f'Кэш ответов: {completion_cache.stats()}')
+        self.transcript.close(winner=self.winner, rounds=self.round, usage=self.total_usage())
 
-    def start_game(self):
+    def report_metrics(self):
+        registry = get_registry()
+        config = get_config()
+        print(registry.summary())
+        print(registry.summary(group_by='tier'))
+        if config.metrics_json:
+            registry.write_json(config.metrics_json)
+        if config.metrics_prometheus:
+            registry.write_prometheus(config.metrics_prometheus)
+
+    async def start_game_async(self):
         print('start start game')
-        self.send_message(prompts.START, 'system')
-        self.send_message(prompts.RULES, 'user')
-        self.choose_roles()
-        self.first_day()
-        self.main_loop()
-        self.end_game()
+        try:
+            if self.stage is None:
+                if self.narration:
+                    await self.send_message_async(prompts.START, role='system')
+                    await self.send_message_async(prompts.RULES, role='user', pinned=True)
+                await self.choose_roles()
+                self.save('choose_roles')
+            if self.stage == 'choose_roles':
+                await self.first_day()
+                self.save('first_day')
+            await self.main_loop()
+            await self.end_game()
+        finally:
+            # Оборванная игра не оставляет после себя фоновых конспектов, а их ошибки не теряются без присмотра
+            if self.compaction is not None:
+                compaction, self.compaction = self.compaction, None
+                compaction.cancel()
+                await asyncio.gather(compaction, return_exceptions=True)
+
+    def start_game(self):
+        asyncio.run(self.start_game_async())
+        self.report_metrics()
+
+    def total_usage(self) -> dict:
+        total = dict(self.usage)
+        for player in self.players:
+            for key, value in player.usage.items():
+                total[key] += value
+        return total
 
     def choose_new_don(self):
         mafia = self.find_players_by_role(Roles.MAFIA)
-        new_don = random.choice(mafia)
+        new_don = self.rng.choice(mafia)
         new_don.role = Roles.DON_MAFIA
         self.say_to_player(new_don, 'Теперь твоя роль: Дон.')
         self.memory.append({
@@ -307,9 +688,18 @@ class Game(BaseNeuroObject):
 
 
 def main():
-    logging_format = '%(asctime)s %(levelname)s %(message)s'
-    logging.basicConfig(filename='log.log', filemode='w', encoding='utf-8', level=logging.INFO, format=logging_format)
-    game = Game(5)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--headless', action='store_true', help='все места занимают боты')
+    parser.add_argument('--checkpoint', default='checkpoint.jsonl', help='файл снимков игры')
+    parser.add_argument('--resume', action='store_true', help='продолжить игру с последнего снимка')
+    args = parser.parse_args()
+    setup_logging('game')
+    if args.resume:
+        game = Game.resume(args.checkpoint)
+    else:
+        game = Game(args.players, seed=args.seed, humans=0 if args.headless else 1, checkpoint=Checkpoint(args.checkpoint))
     game.start_game()
 
 
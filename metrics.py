@@ -0,0 +1,176 @@
+import json
+import math
+import threading
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+TOKEN_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 32768, math.inf)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        # Оценка по корзинам с линейной интерполяцией внутри корзины
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                if math.isinf(bound):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            if not math.isinf(bound):
+                lower = bound
+        return lower
+
+    def to_dict(self) -> dict:
+        return {
+            'buckets': [str(bound) if math.isinf(bound) else bound for bound in self.buckets],
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms: dict[tuple, Histogram] = {}
+        self.counters: dict[tuple, float] = defaultdict(float)
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[self._key(name, labels)] += value
+
+    def record_call(self, caller: str, phase: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                    retries: int = 0, ttft: float | None = None, cached: bool = False, **labels):
+        labels = {'caller': caller, 'phase': phase, **labels}
+        self.increment('llm_requests_total', cached=str(cached).lower(), **labels)
+        self.observe('llm_request_latency_seconds', latency, **labels)
+        if ttft is not None:
+            self.observe('llm_time_to_first_token_seconds', ttft, **labels)
+        if not cached:
+            self.observe('llm_prompt_tokens', prompt_tokens, TOKEN_BUCKETS, **labels)
+            self.increment('llm_prompt_tokens_total', prompt_tokens, **labels)
+            self.increment('llm_completion_tokens_total', completion_tokens, **labels)
+        if retries:
+            self.increment('llm_retries_total', retries, **labels)
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels), **histogram.to_dict()}
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        def format_labels(labels: tuple, extra: dict | None = None) -> str:
+            items = list(labels) + list((extra or {}).items())
+            if not items:
+                return ''
+            values = ','.join(f'{key}="{str(value).replace(chr(34), chr(92) + chr(34))}"' for key, value in items)
+            return '{' + values + '}'
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (counter_name, labels), value in self.counters.items():
+                    if counter_name == name:
+                        lines.append(f'{name}{format_labels(labels)} {value:g}')
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (histogram_name, labels), histogram in self.histograms.items():
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if math.isinf(bound) else f'{bound:g}'
+                        lines.append(f'{name}_bucket{format_labels(labels, {"le": le})} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_json(), file, ensure_ascii=False, indent=2)
+
+    def write_prometheus(self, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+
+    def summary(self, group_by: str = 'phase') -> str:
+        latency = defaultdict(lambda: Histogram())
+        counters = defaultdict(lambda: defaultdict(float))
+        with self._lock:
+            for (name, labels), histogram in self.histograms.items():
+                if name == 'llm_request_latency_seconds':
+                    merged = latency[dict(labels).get(group_by, '')]
+                    merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                    merged.count += histogram.count
+                    merged.sum += histogram.sum
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if name == 'llm_requests_total' and labels['cached'] == 'true':
+                    name = 'cached'
+                counters[labels.get(group_by, '')][name] += value
+        header = f'{group_by:<16}{"calls":>8}{"cached":>8}{"mean, s":>10}{"p95, s":>10}{"total, s":>10}{"prompt":>10}{"compl.":>10}{"retries":>9}'
+        lines = [header, '-' * len(header)]
+        for group in sorted(latency, key=lambda group: -latency[group].sum):
+            histogram = latency[group]
+            values = counters[group]
+            lines.append(
+                f'{group:<16}{histogram.count:>8}{values["cached"]:>8.0f}{histogram.mean():>10.2f}{histogram.quantile(0.95):>10.2f}'
+                f'{histogram.sum:>10.1f}{values["llm_prompt_tokens_total"]:>10.0f}{values["llm_completion_tokens_total"]:>10.0f}'
+                f'{values["llm_retries_total"]:>9.0f}'
+            )
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
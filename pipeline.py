@@ -0,0 +1,44 @@
+import asyncio
+import logging
+from functools import partial
+from client import get_executor
+from metrics import get_registry
+
+logger = logging.getLogger(__name__)
+
+
+class Speculation:
+    # Заранее генерирует следующую реплику объекта, пока ходят другие игроки. Ответ принимается, только если
+    # за это время объект не увидел новых событий, иначе он выбрасывается и реплика генерируется заново.
+    def __init__(self, obj, message: str, temperature: float = 0.0, **kwargs):
+        self.obj = obj
+        self.message = message
+        self.temperature = temperature
+        self.kwargs = kwargs
+        self.cursor = len(obj.memory)
+        context = obj.build_context(message) + [{'role': 'user', 'content': message}]
+        loop = asyncio.get_running_loop()
+        self.future = loop.run_in_executor(get_executor(), partial(obj._complete, context, temperature))
+
+    def valid(self) -> bool:
+        return len(self.obj.memory) == self.cursor
+
+    async def result(self, echo: str | None = None) -> str:
+        if self.valid():
+            try:
+                answer = await self.future
+            except Exception as e:
+                logger.warning(f'{self.obj.name}: упреждающий запрос не удался ({e!r}), повторяем')
+            else:
+                if self.valid():
+                    get_registry().increment('speculation_total', caller=self.obj.name, result='hit')
+                    self.obj.memory.append({'role': 'user', 'content': self.message})
+                    self.obj.memory.append({'role': 'assistant', 'content': answer})
+                    logger.debug('%s >>> %s', self.obj.name, self.message)
+                    logger.debug('%s <<< %s', self.obj.name, answer)
+                    if echo is not None:
+                        self.obj.output(f'{echo}{answer}')
+                    return answer
+        get_registry().increment('speculation_total', caller=self.obj.name, result='miss')
+        self.future.cancel()
+        return await self.obj.send_message_async(self.message, temperature=self.temperature, echo=echo, **self.kwargs)
@@ -146,3 +146,25 @@ START_VOTING = """
 ТОЛЬКО ИМЯ (ОДНО СЛОВО ИЗ СПИСКА ВСЕХ ИГРОКОВ).
 ОБЯЗАТЕЛЬНО СКАЖИ ФРАЗУ "В ОТВЕТЕ ДОЛЖНО БЫТЬ ТОЛЬКО ОДНО СЛОВО - ИМЯ ИЗ СПИСКА ИГРОКОВ".
 """
+
+SUMMARIZE = """
+Ты ведёшь краткий конспект игры "Мафия" от лица одного участника.
+Тебе дадут предыдущий конспект и новые события. Составь обновлённый конспект: кто что говорил, кого в чём обвиняли,
+за кого голосовали, кто выбыл и что известно о ролях. Пиши коротко, по пунктам, только факты. Не придумывай ничего нового.
+"""
+
+PLAYER_NAMES = [
+    'Алексей', 'Борис', 'Виктор', 'Глеб', 'Дмитрий', 'Егор', 'Жанна', 'Зоя', 'Игорь', 'Кира',
+    'Лев', 'Мария', 'Никита', 'Ольга', 'Павел', 'Роман', 'Светлана', 'Тимур', 'Ульяна', 'Фёдор',
+]
+
+NIGHT_TEMPLATE = 'Наступает ночь. Город засыпает, все игроки закрывают глаза.'
+SHERIFF_TEMPLATE = 'Просыпается шериф. Шериф, выбери игрока, чью роль хочешь проверить.'
+MAFIA_TEMPLATE = 'Просыпаются мафия и дон. Выберите, кого из игроков устранить этой ночью.'
+DON_TEMPLATE = 'Дон, тебе принимать окончательное решение. Назови игрока.'
+DAY_TEMPLATE = 'Наступает день, город просыпается. Этой ночью нас покинул игрок {name}.'
+DISCUSSION_TEMPLATE = 'Обсудите произошедшее. Кого вы подозреваете и почему?'
+VOTING_TEMPLATE = 'Пришло время голосования. Каждый игрок должен назвать имя другого игрока, которого хочет исключить. В ОТВЕТЕ ДОЛЖНО БЫТЬ ТОЛЬКО ОДНО СЛОВО - ИМЯ ИЗ СПИСКА ИГРОКОВ.'
+END_TEMPLATE = 'Игра окончена. Победили: {winner}.'
+
+NAME_CORRECTION = 'Такого игрока нет. Назови ТОЛЬКО ОДНО ИМЯ из списка: {names}.'
@@ -0,0 +1,129 @@
+import difflib
+import json
+import logging
+import re
+from collections.abc import Callable
+from config import get_config
+from metrics import get_registry
+from routing import Tier
+import prompts
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+# Падежные окончания имён по последней букве именительного падежа. Окончания, а не любой хвост после основы,
+# чтобы «Левый» не считался формой имени «Лев».
+CASE_ENDINGS = {
+    'а': ('а', 'ы', 'и', 'е', 'у', 'ой', 'ою'),
+    'я': ('я', 'и', 'е', 'ю', 'ей', 'ею'),
+    'ь': ('ь', 'я', 'ю', 'ем', 'е'),
+    'й': ('й', 'я', 'ю', 'ем', 'е', 'и'),
+}
+CONSONANT_ENDINGS = ('', 'а', 'у', 'ом', 'е')
+
+
+def normalize(text: str) -> str:
+    return text.casefold().replace('ё', 'е')
+
+
+def declensions(name: str) -> set[str]:
+    name = normalize(name)
+    endings = CASE_ENDINGS.get(name[-1])
+    if endings is None:
+        return {name + ending for ending in CONSONANT_ENDINGS}
+    return {name[:-1] + ending for ending in endings}
+
+
+def name_said(names: list[str]) -> Callable[[str], bool]:
+    # Поток обрывается, только когда ответ точно закончен: пришёл закрытый JSON-объект или весь ответ - одно имя
+    # с завершающим знаком. Свободный текст дочитывается до конца, ведь выбором считается последнее имя в нём.
+    pattern = re.compile(r'\s*["«\']?(?:' + '|'.join(map(re.escape, names)) + r')["»\']?[.!\n]', re.IGNORECASE)
+
+    def stop(text: str) -> bool:
+        stripped = text.strip()
+        if stripped.startswith('{') and stripped.endswith('}'):
+            try:
+                return isinstance(json.loads(stripped), dict)
+            except json.JSONDecodeError:
+                return False
+        return pattern.fullmatch(text) is not None
+
+    return stop
+
+
+def name_schema(names: list[str]) -> dict:
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'player_choice',
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string', 'enum': names},
+                },
+                'required': ['name'],
+                'additionalProperties': False,
+            },
+        },
+    }
+
+
+def _match_word(word: str, names: list[str]) -> str | None:
+    word = normalize(word)
+    for name in names:
+        if normalize(name) == word:
+            return name
+    # Падежные формы: «Бориса», «Марию», «Игорем»
+    for name in names:
+        if word in declensions(name):
+            return name
+    close = difflib.get_close_matches(word, [normalize(name) for name in names], n=1, cutoff=0.8)
+    if close:
+        return next(name for name in names if normalize(name) == close[0])
+    return None
+
+
+def match_name(answer: str, names: list[str]) -> str | None:
+    try:
+        data = json.loads(answer)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict) and isinstance(data.get('name'), str):
+        answer = data['name']
+    # Если в ответе несколько имён, берём последнее - обычно это и есть выбор
+    for word in reversed(WORD_RE.findall(answer)):
+        name = _match_word(word, names)
+        if name is not None:
+            return name
+    return None
+
+
+async def ask_name(player, prompt: str, names: list[str], **kwargs) -> str:
+    # Спрашивает у игрока имя из списка names. Бот получает короткую поправку не больше NAME_RETRIES раз,
+    # после чего выбор делается случайно, чтобы игра не прерывалась.
+    if not player.bot:
+        answer = await player.do_step_async(prompt)
+        name = match_name(answer, names)
+        while name is None:
+            player.game.say_to_player(player, prompts.NAME_CORRECTION.format(names=', '.join(names)))
+            answer = await player.do_step_async(prompt)
+            name = match_name(answer, names)
+        return name
+    config = get_config()
+    if config.structured_output:
+        kwargs['response_format'] = name_schema(names)
+    kwargs.setdefault('stop', name_said(names))
+    kwargs.setdefault('tier', Tier.VOTING)
+    answer = await player.do_step_async(prompt, **kwargs)
+    name = match_name(answer, names)
+    retries = 0
+    while name is None and retries < config.name_retries:
+        retries += 1
+        get_registry().increment('llm_retries_total', caller=player.name, phase=player.phase)
+        answer = await player.do_step_async(prompts.NAME_CORRECTION.format(names=', '.join(names)), **kwargs)
+        name = match_name(answer, names)
+    if name is None:
+        name = player.game.rng.choice(names)
+        logger.warning(f'{player.name} не назвал имя из списка ({answer!r}), выбран случайный игрок {name}')
+    return name
@@ -0,0 +1,108 @@
+import re
+import zlib
+import numpy as np
+from client import get_client
+
+WORD_RE = re.compile(r'\w+')
+
+
+class HashingEmbedder:
+    # Офлайн-эмбеддер: hashing trick по словам (с грубым стеммингом) и биграммам, веса tf-idf.
+    def __init__(self, dim: int = 1024, stem: int = 5, use_idf: bool = True):
+        self.dim = dim
+        self.stem = stem
+        self.use_idf = use_idf
+        self.df = np.zeros(dim, dtype=np.float32)
+        self.documents = 0
+
+    def _features(self, text: str) -> list[int]:
+        words = [word[:self.stem] for word in WORD_RE.findall(text.lower().replace('ё', 'е'))]
+        features = words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+        return [zlib.crc32(feature.encode()) % self.dim for feature in features]
+
+    def _embed(self, texts: list[str], update: bool) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = self._features(text)
+            if buckets:
+                np.add.at(vectors[row], buckets, 1.0)
+        if update:
+            self.df += (vectors > 0).sum(axis=0)
+            self.documents += len(texts)
+        np.log1p(vectors, out=vectors)
+        if self.use_idf and self.documents:
+            vectors *= np.log((1 + self.documents) / (1 + self.df)) + 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        return self._embed(texts, update=True)
+
+    def embed_queries(self, texts: list[str]) -> np.ndarray:
+        return self._embed(texts, update=False)
+
+
+class OpenAIEmbedder:
+    def __init__(self, model: str):
+        self.model = model
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        response = get_client().embeddings.create(model=self.model, input=texts)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        return self._embed(texts)
+
+    def embed_queries(self, texts: list[str]) -> np.ndarray:
+        return self._embed(texts)
+
+
+class RetrievalMemory:
+    # Матрица начинается с capacity строк и удваивается по мере роста: у каждого бота за столом свой индекс
+    def __init__(self, embedder=None, capacity: int = 32):
+        self.embedder = embedder if embedder is not None else HashingEmbedder()
+        self.capacity = capacity
+        self.matrix: np.ndarray | None = None
+        self.ids: list[int] = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, texts: list[str], ids: list[int]):
+        if not texts:
+            return
+        vectors = self.embedder.embed_documents(texts)
+        size = len(self.ids)
+        if self.matrix is None:
+            self.matrix = np.zeros((max(self.capacity, len(texts)), vectors.shape[1]), dtype=np.float32)
+        elif size + len(texts) > self.matrix.shape[0]:
+            grown = np.zeros((max(self.matrix.shape[0] * 2, size + len(texts)), self.matrix.shape[1]), dtype=np.float32)
+            grown[:size] = self.matrix[:size]
+            self.matrix = grown
+        self.matrix[size:size + len(texts)] = vectors
+        self.ids.extend(ids)
+
+    def search(self, queries: list[str], k: int) -> list[list[tuple[int, float]]]:
+        if not self.ids or k <= 0:
+            return [[] for _ in queries]
+        scores = self.embedder.embed_queries(queries) @ self.matrix[:len(self.ids)].T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        result = []
+        for row, candidates in enumerate(top):
+            candidates = candidates[np.argsort(-scores[row, candidates])]
+            result.append([(self.ids[i], float(scores[row, i])) for i in candidates if scores[row, i] > 0])
+        return result
+
+
+def create_embedder(name: str, model: str | None = None):
+    match name:
+        case 'hashing':
+            return HashingEmbedder()
+        case 'openai':
+            return OpenAIEmbedder(model)
+        case _:
+            raise ValueError(f'Unknown embedder: {name}')
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import threading
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Вместо модели можно указать template: тогда ведущий говорит заготовленными фразами из prompts
+TEMPLATE = 'template'
+
+
+class Tier:
+    NARRATION = 'narration'
+    SETUP = 'setup'
+    DISCUSSION = 'discussion'
+    VOTING = 'voting'
+    SUMMARY = 'summary'
+    END = 'end'
+
+
+TIERS = (Tier.NARRATION, Tier.SETUP, Tier.DISCUSSION, Tier.VOTING, Tier.SUMMARY, Tier.END)
+
+
+class Router:
+    # Выбирает модель для каждого класса запросов: дешёвую для реплик ведущего, сильную для рассуждений ботов
+    def __init__(self, routes: dict[str, str] | None = None, fallback: str | None = None, fallback_timeout: float = 0.0):
+        self.routes = {tier: model for tier, model in (routes or {}).items() if model}
+        self.fallback = fallback
+        self.fallback_timeout = fallback_timeout
+
+    def model(self, tier: str | None, default: str) -> str:
+        model = self.routes.get(tier)
+        return default if model is None or model == TEMPLATE else model
+
+    def templated(self, tier: str) -> bool:
+        return self.routes.get(tier) == TEMPLATE
+
+    def timeout(self, model: str) -> float | None:
+        # Ограничение по времени нужно, только если есть на что переключиться
+        if self.fallback and self.fallback_timeout and model != self.fallback:
+            return self.fallback_timeout
+        return None
+
+
+def load_routes(path: str) -> dict[str, str]:
+    with open(path, encoding='utf-8') as file:
+        routes = json.load(file)
+    unknown = set(routes) - set(TIERS)
+    if unknown:
+        raise ValueError(f'Неизвестные классы запросов в {path}: {", ".join(sorted(unknown))}')
+    return routes
+
+
+def create_router() -> Router:
+    config = get_config()
+    routes = dict(config.routes)
+    if not config.narration:
+        routes[Tier.NARRATION] = TEMPLATE
+        routes[Tier.END] = TEMPLATE
+    if config.routes_file:
+        routes.update(load_routes(config.routes_file))
+    router = Router(routes, config.fallback_model, config.fallback_timeout)
+    logger.info(f'Маршрутизация моделей: {router.routes or "все запросы на MODEL"}, запасная модель {router.fallback}')
+    return router
+
+
+_lock = threading.Lock()
+_router: Router | None = None
+_router_pid: int | None = None
+
+
+def get_router() -> Router:
+    global _router, _router_pid
+    with _lock:
+        if _router is None or _router_pid != os.getpid():
+            _router = create_router()
+            _router_pid = os.getpid()
+        return _router
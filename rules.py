@@ -0,0 +1,66 @@
+import random
+import prompts
+
+
+class Roles:
+    CIVILIAN = 1
+    SHERIFF = 2
+    MAFIA = 3
+    DON_MAFIA = 4
+
+
+class Teams:
+    CIVILIANS = 'Мирные'
+    MAFIA = 'Мафия'
+
+
+ROLE_NAMES = {
+    Roles.CIVILIAN: 'Мирный',
+    Roles.SHERIFF: 'Шериф',
+    Roles.MAFIA: 'Мафия',
+    Roles.DON_MAFIA: 'Дон',
+}
+
+
+def role_name(role: int) -> str:
+    return ROLE_NAMES[role]
+
+
+def parse_role(name: str) -> int | None:
+    for role, role_title in ROLE_NAMES.items():
+        if role_title == name:
+            return role
+    return None
+
+
+def is_mafia(role: int) -> bool:
+    return role in (Roles.MAFIA, Roles.DON_MAFIA)
+
+
+def assign_roles(players_count: int, rng: random.Random) -> list[int]:
+    # Примерно треть игроков - мафия (один из них дон), шериф есть, если мирных хотя бы двое
+    mafia_count = max(1, players_count // 3)
+    roles = [Roles.DON_MAFIA] + [Roles.MAFIA] * (mafia_count - 1)
+    if players_count - mafia_count >= 2:
+        roles.append(Roles.SHERIFF)
+    roles += [Roles.CIVILIAN] * (players_count - len(roles))
+    rng.shuffle(roles)
+    return roles
+
+
+def assign_names(players_count: int, rng: random.Random) -> list[str]:
+    return rng.sample(prompts.PLAYER_NAMES, players_count)
+
+
+def sheriff_check(player) -> str:
+    return f'{player.name} - {role_name(player.role)}'
+
+
+def winner(players) -> str | None:
+    alive = [player for player in players if player.alive]
+    mafia = sum(1 for player in alive if is_mafia(player.role))
+    if mafia == 0:
+        return Teams.CIVILIANS
+    if mafia >= len(alive) - mafia:
+        return Teams.MAFIA
+    return None
@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import openai
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class Priority:
+    CRITICAL = 0
+    NORMAL = 1
+    BACKGROUND = 2
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        # Забирает amount (можно уйти в минус) и возвращает, сколько секунд подождать до начала запроса
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+
+def retry_after(error: Exception) -> float | None:
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retriable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class Scheduler:
+    # Очередь с приоритетами перед всеми запросами к модели: ограничения RPM/TPM, AIMD-подстройка параллелизма
+    # по 429 и задержкам, экспоненциальные повторы с jitter и автоматический выключатель.
+    def __init__(self, max_concurrency: int, rpm: float = 0, tpm: float = 0, min_concurrency: int = 1, target_latency: float = 30.0,
+                 max_retries: int = 4, backoff_base: float = 1.0, backoff_max: float = 30.0, breaker_threshold: int = 5,
+                 breaker_cooldown: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.active = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_running = False
+        self.rng = random.Random()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _acquire(self, priority: int):
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._queue, entry)
+            while self._queue[0] != entry or self.active >= int(self.limit):
+                self._condition.wait()
+            heapq.heappop(self._queue)
+            self.active += 1
+            self._condition.notify_all()
+
+    def _release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def _check_circuit(self) -> bool:
+        # Возвращает True, если запрос пробный (выключатель полуоткрыт)
+        with self._condition:
+            if not self.failures >= self.breaker_threshold:
+                return False
+            if time.monotonic() < self.open_until or self.trial_running:
+                raise CircuitOpenError(f'Circuit is open after {self.failures} consecutive failures')
+            self.trial_running = True
+            return True
+
+    def _on_success(self, latency: float, trial: bool):
+        with self._condition:
+            self.failures = 0
+            if trial:
+                self.trial_running = False
+            if latency > self.target_latency:
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _on_failure(self, error: Exception, trial: bool):
+        with self._condition:
+            self.failures += 1
+            if trial:
+                self.trial_running = False
+            if isinstance(error, openai.RateLimitError):
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            if self.failures >= self.breaker_threshold:
+                self.open_until = time.monotonic() + self.breaker_cooldown
+                logger.warning(f'Выключатель разомкнут на {self.breaker_cooldown} с после {self.failures} ошибок подряд')
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        delay = self.rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        hint = retry_after(error)
+        return max(delay, hint) if hint is not None else delay
+
+    def submit(self, fn, priority: int = Priority.NORMAL, tokens: int = 0, retriable=is_retriable) -> tuple:
+        # Возвращает результат fn() и число повторов
+        attempt = 0
+        while True:
+            trial = self._check_circuit()
+            # Ждём лимитов RPM/TPM до того, как занять место: иначе спящий запрос держал бы слот параллелизма
+            wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+            if wait:
+                time.sleep(wait)
+            self._acquire(priority)
+            try:
+                started = time.perf_counter()
+                result = fn()
+            except Exception as e:
+                self._release()
+                if not retriable(e):
+                    if trial:
+                        with self._condition:
+                            self.trial_running = False
+                    raise
+                self._on_failure(e, trial)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.info(f'Повтор запроса через {delay:.1f} с ({type(e).__name__}), параллелизм {self.limit:.1f}')
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._release()
+            self._on_success(time.perf_counter() - started, trial)
+            return result, attempt
+
+
+_lock = threading.Lock()
+_scheduler: Scheduler | None = None
+_scheduler_pid: int | None = None
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler, _scheduler_pid
+    with _lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            config = get_config()
+            _scheduler = Scheduler(
+                config.max_concurrency,
+                rpm=config.rpm,
+                tpm=config.tpm,
+                target_latency=config.target_latency,
+                max_retries=config.max_retries,
+                backoff_base=config.backoff_base,
+                backoff_max=config.backoff_max,
+                breaker_threshold=config.breaker_threshold,
+                breaker_cooldown=config.breaker_cooldown,
+            )
+            _scheduler_pid = os.getpid()
+        return _scheduler
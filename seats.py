@@ -0,0 +1,42 @@
+import asyncio
+
+
+class SessionTimeout(Exception):
+    pass
+
+
+class ConsoleSeat:
+    # Место живого игрока за терминалом
+    def write(self, text: str):
+        print(text, end='', flush=True)
+
+    async def ask(self, prompt: str) -> str:
+        return await asyncio.to_thread(input, prompt)
+
+
+class StreamSeat:
+    # Место живого игрока, подключённого по TCP. Протокол построчный: сервер пишет текст, игрок отвечает одной строкой.
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, idle_timeout: float):
+        self.reader = reader
+        self.writer = writer
+        self.idle_timeout = idle_timeout
+        self.loop = asyncio.get_running_loop()
+
+    def _write(self, text: str):
+        if not self.writer.is_closing():
+            self.writer.write(text.encode())
+
+    def write(self, text: str):
+        # Может вызываться из потоков пула (потоковая выдача ответа модели)
+        self.loop.call_soon_threadsafe(self._write, text)
+
+    async def ask(self, prompt: str) -> str:
+        self._write(prompt)
+        await self.writer.drain()
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), self.idle_timeout)
+        except TimeoutError:
+            raise SessionTimeout(f'No answer for {self.idle_timeout} seconds')
+        if not line:
+            raise ConnectionResetError('Player disconnected')
+        return line.decode(errors='replace').strip()
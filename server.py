@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+from config import get_config
+from logs import setup_logging
+from main import Game
+from seats import SessionTimeout, StreamSeat
+
+logger = logging.getLogger(__name__)
+
+
+class GameServer:
+    # Много игр в одном процессе: у каждого подключения свой стол с одним живым игроком,
+    # клиент, пул соединений и планировщик запросов общие.
+    def __init__(self, players: int, max_sessions: int, idle_timeout: float, session_timeout: float):
+        self.players = players
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.session_timeout = session_timeout
+        self.sessions = 0
+        self.started = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername')
+        if self.sessions >= self.max_sessions:
+            writer.write('Сервер занят, попробуйте позже.\n'.encode())
+            await writer.drain()
+            writer.close()
+            return
+        self.sessions += 1
+        self.started += 1
+        session_id = self.started
+        logger.info(f'Сессия {session_id} ({peer}) началась, активных сессий: {self.sessions}')
+        seat = StreamSeat(reader, writer, self.idle_timeout)
+        game = Game(self.players, seats=[seat])
+        logger.info(f'Сессия {session_id}: игра {game.game_id}')
+        error = None
+        try:
+            await asyncio.wait_for(game.start_game_async(), self.session_timeout)
+        except SessionTimeout:
+            error = 'idle timeout'
+            seat.write('Время ожидания хода истекло, игра завершена.\n')
+        except TimeoutError:
+            error = 'session timeout'
+            seat.write('Игра идёт слишком долго и была остановлена.\n')
+        except ConnectionError:
+            error = 'disconnected'
+            logger.info(f'Сессия {session_id}: игрок отключился')
+        except Exception as e:
+            error = repr(e)
+            logger.exception(f'Сессия {session_id} завершилась с ошибкой')
+            seat.write('Произошла ошибка, игра завершена.\n')
+        finally:
+            self.sessions -= 1
+            # Стенограмма оборванной игры тоже должна попасть на диск
+            game.transcript.close(winner=game.winner, rounds=game.round, usage=game.total_usage(), error=error)
+            logger.info(f'Сессия {session_id} закончилась, раундов {game.round}, победили: {game.winner}')
+            # Даём отправиться последним сообщениям, записанным через call_soon_threadsafe
+            await asyncio.sleep(0)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f'Сервер слушает {host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    config = get_config()
+    parser = argparse.ArgumentParser(description='Сервер для одновременной игры за многими столами')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--max-sessions', type=int, default=config.max_sessions)
+    parser.add_argument('--idle-timeout', type=float, default=config.idle_timeout)
+    parser.add_argument('--session-timeout', type=float, default=config.session_timeout)
+    args = parser.parse_args()
+    setup_logging('server')
+    # По SIGTERM выходим штатно, чтобы atexit успел дописать логи
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = GameServer(args.players, args.max_sessions, args.idle_timeout, args.session_timeout)
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
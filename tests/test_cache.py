@@ -0,0 +1,49 @@
+from cache import CompletionCache, request_key
+
+
+def make_cache(tmp_path, max_bytes: int = 10_000, memory_items: int = 4) -> CompletionCache:
+    return CompletionCache(str(tmp_path / 'cache.sqlite'), max_bytes, memory_items)
+
+
+def test_request_key_depends_on_request():
+    messages = [{'role': 'user', 'content': 'Привет'}]
+    assert request_key('a', messages, temperature=0.0) == request_key('a', messages, temperature=0.0)
+    assert request_key('a', messages, temperature=0.0) != request_key('b', messages, temperature=0.0)
+    assert request_key('a', messages, temperature=0.0) != request_key('a', messages, temperature=0.2)
+
+
+def test_get_and_put(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get('k') is None
+    cache.put('k', 'ответ')
+    assert cache.get('k') == 'ответ'
+    cache.close()
+    cache = make_cache(tmp_path)
+    assert cache.get('k') == 'ответ'
+    assert cache.stats()['hits'] == 1
+    cache.close()
+
+
+def test_running_total_matches_disk(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10**9)
+    for i in range(50):
+        cache.put(f'k{i}', 'x' * i)
+    cache.put('k10', 'y' * 100)
+    assert cache.total == cache._total()
+    cache.close()
+    assert make_cache(tmp_path).total == cache.total
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=2_000, memory_items=4)
+    cache.put('hot', 'x' * 100)
+    for i in range(30):
+        cache.put(f'k{i}', 'x' * 100)
+        # Горячий ключ всё время отвечает из памяти процесса
+        assert cache.get('hot') is not None
+    assert cache.evictions
+    assert cache.total <= 2_000
+    cache.memory.clear()
+    assert cache.get('hot') is not None
+    assert cache.get('k0') is None
+    cache.close()
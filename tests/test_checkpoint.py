@@ -0,0 +1,75 @@
+import pytest
+import routing
+from backends import FakeClient
+from checkpoint import Checkpoint
+from client import set_client
+from config import get_config
+
+
+class CrashingClient(FakeClient):
+    # Падает на запросе с номером crash_at, как оборвавшаяся сеть, и запоминает, какие модели спрашивали
+    def __init__(self, crash_at: int | None = None):
+        super().__init__(seed=5)
+        self.crash_at = crash_at
+        self.models = []
+        create = self.chat.completions.create
+
+        def crashing_create(model, messages, **params):
+            if self.crash_at is not None and len(self.models) >= self.crash_at:
+                raise RuntimeError('crash')
+            self.models.append((messages[-1]['content'], model))
+            return create(model=model, messages=messages, **params)
+
+        self.chat.completions.create = crashing_create
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setenv('CACHE', '0')
+    monkeypatch.setenv('OPENROUTER_API', 'x')
+    monkeypatch.setenv('MODEL', 'strong')
+    monkeypatch.setenv('MODEL_NARRATION', 'cheap')
+    get_config.cache_clear()
+    monkeypatch.setattr(routing, '_router', None)
+    yield
+    get_config.cache_clear()
+
+
+def test_resume_after_crash(tmp_path):
+    from main import Game
+    path = str(tmp_path / 'checkpoint.jsonl')
+    client = CrashingClient(crash_at=40)
+    set_client(client)
+    game = Game(7, seed=3, humans=0, checkpoint=Checkpoint(path))
+    with pytest.raises(RuntimeError):
+        game.start_game()
+    assert game.stage in ('night', 'day')
+    finished = len(client.models)
+
+    client = CrashingClient()
+    set_client(client)
+    resumed = Game.resume(path)
+    assert resumed.stage == game.stage
+    assert [(p.name, p.role) for p in resumed.players] == [(p.name, p.role) for p in game.players]
+    assert not resumed.model_pinned
+    resumed.start_game()
+    assert resumed.winner is not None
+    # Законченные фазы не повторяются: брифинг ботов и знакомство не отправляются заново
+    assert len(client.models) < finished
+    assert not any(prompt.startswith('Теперь представься') for prompt, _ in client.models)
+    narration = {model for prompt, model in client.models if 'НЕ ПРИДУМЫВАЙ' in prompt}
+    assert narration == {'cheap'}
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    from main import Game
+    path = tmp_path / 'checkpoint.jsonl'
+    set_client(CrashingClient())
+    game = Game(5, seed=1, humans=0, checkpoint=Checkpoint(str(path)))
+    game.start_game()
+    saved = path.read_bytes()
+    with open(path, 'ab') as file:
+        file.write(b'{"stage": "day", "ev')
+    stage, events, state = Checkpoint(str(path), resume=True).load()
+    assert path.read_bytes() == saved
+    assert state['end'] and len(events) <= len(game.events)
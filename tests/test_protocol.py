@@ -0,0 +1,67 @@
+import pytest
+from prompts import PLAYER_NAMES
+from protocol import match_name, name_said
+
+
+@pytest.mark.parametrize('answer, expected', [
+    ('Борис', 'Борис'),
+    ('Бориса', 'Борис'),
+    ('Марию', 'Мария'),
+    ('Игорем', 'Игорь'),
+    ('Алексея', 'Алексей'),
+    ('Никитой', 'Никита'),
+    ('Ольги', 'Ольга'),
+    ('Павла', 'Павел'),
+    ('Федор', 'Фёдор'),
+    ('фёдора', 'Фёдор'),
+    ('Я голосую за Светлану.', 'Светлана'),
+    ('{"name": "Зоя"}', 'Зоя'),
+])
+def test_match_name(answer, expected):
+    assert match_name(answer, PLAYER_NAMES) == expected
+
+
+@pytest.mark.parametrize('answer', ['Левый', 'Никого', 'Не знаю', ''])
+def test_match_name_rejects(answer):
+    assert match_name(answer, PLAYER_NAMES) is None
+
+
+def test_match_name_takes_last_name():
+    assert match_name('Думал про Тимура, но выбираю Киру', PLAYER_NAMES) == 'Кира'
+
+
+def test_match_name_only_from_list():
+    assert match_name('Бориса', ['Глеб', 'Зоя']) is None
+
+
+def stream(answer: str, stop, size: int = 3) -> str:
+    # Как BaseNeuroObject._stream: ответ приходит кусками, после каждого проверяется условие остановки
+    text = ''
+    for i in range(0, len(answer), size):
+        text += answer[i:i + size]
+        if stop(text):
+            break
+    return text
+
+
+def test_name_said():
+    stop = name_said(['Борис', 'Зоя'])
+    assert not stop('Я выбираю Бор')
+    assert not stop('Я выбираю Борис.')
+    assert not stop('Борис ')
+    assert stop('Борис.')
+    assert stop('«Зоя»\n')
+    assert not stop('{"name": "Бо')
+    assert stop('{"name": "Борис"}')
+
+
+@pytest.mark.parametrize('answer, expected', [
+    ('Борис вёл себя честно, поэтому я голосую за Киру', 'Кира'),
+    ('Тимур, хотя нет, Борис.', 'Борис'),
+    ('{"name": "Тимур"} а ещё текст', 'Тимур'),
+    ('Кира.', 'Кира'),
+])
+def test_streamed_vote(answer, expected):
+    names = ['Борис', 'Кира', 'Тимур']
+    text = stream(answer, name_said(names))
+    assert match_name(text, names) == expected
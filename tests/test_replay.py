@@ -0,0 +1,35 @@
+import pytest
+from backends import FakeClient, RecordingClient, ReplayClient
+from client import set_client
+from config import get_config
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setenv('CACHE', '0')
+    monkeypatch.setenv('OPENROUTER_API', 'x')
+    get_config.cache_clear()
+    yield
+    get_config.cache_clear()
+
+
+def play(client, seed: int = 11) -> dict:
+    # Боты отвечают параллельно, поэтому общий журнал может перемешаться. Сравниваем то, что видел каждый участник.
+    from main import Game
+    set_client(client)
+    game = Game(7, seed=seed, humans=0)
+    game.start_game()
+    views = {obj.name: list(obj.memory) for obj in [game, *game.players]}
+    return {'winner': game.winner, 'rounds': game.round, 'views': views}
+
+
+def test_fake_games_are_reproducible():
+    assert play(FakeClient(seed=1, jitter=0.01)) == play(FakeClient(seed=1, jitter=0.01))
+
+
+def test_replay_recorded_game(tmp_path):
+    cassette = str(tmp_path / 'cassette.jsonl')
+    recorder = RecordingClient(FakeClient(seed=2, jitter=0.01), cassette)
+    recorded = play(recorder)
+    recorder.close()
+    assert play(ReplayClient(cassette)) == recorded
@@ -0,0 +1,97 @@
+import threading
+import time
+import openai
+import pytest
+from backends import FakeClient
+from scheduler import CircuitOpenError, Priority, Scheduler
+
+
+def make_scheduler(**kwargs) -> Scheduler:
+    kwargs.setdefault('backoff_base', 0)
+    return Scheduler(4, **kwargs)
+
+
+def request(client: FakeClient):
+    return lambda: client.chat.completions.create(model='fake', messages=[{'role': 'user', 'content': 'Привет'}])
+
+
+def test_retries_rate_limited_requests():
+    client = FakeClient(seed=3, error_rate=0.5)
+    scheduler = make_scheduler(max_retries=10)
+    for _ in range(10):
+        calls = client.calls
+        completion, attempts = scheduler.submit(request(client))
+        assert completion.choices[0].message.content
+        assert client.calls - calls == attempts + 1
+
+
+def test_gives_up_after_max_retries():
+    client = FakeClient(error_rate=1.0)
+    scheduler = make_scheduler(max_retries=2, breaker_threshold=100)
+    with pytest.raises(openai.RateLimitError):
+        scheduler.submit(request(client))
+    assert client.calls == 3
+
+
+def test_rate_limit_halves_concurrency():
+    client = FakeClient(error_rate=1.0)
+    scheduler = make_scheduler(max_retries=1, breaker_threshold=100)
+    with pytest.raises(openai.RateLimitError):
+        scheduler.submit(request(client))
+    assert scheduler.limit == 1
+
+
+def test_backoff_honours_retry_after():
+    client = FakeClient(error_rate=1.0, retry_after=2.5)
+    with pytest.raises(openai.RateLimitError) as error:
+        request(client)()
+    assert make_scheduler().backoff(0, error.value) == 2.5
+
+
+def test_does_not_retry_other_errors():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError('bad request')
+
+    with pytest.raises(ValueError):
+        make_scheduler(max_retries=3).submit(fail)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_and_recovers():
+    client = FakeClient(error_rate=1.0)
+    scheduler = make_scheduler(max_retries=0, breaker_threshold=2, breaker_cooldown=0.05)
+    for _ in range(2):
+        with pytest.raises(openai.RateLimitError):
+            scheduler.submit(request(client))
+    with pytest.raises(CircuitOpenError):
+        scheduler.submit(request(client))
+    assert client.calls == 2
+    time.sleep(0.06)
+    client.error_rate = 0.0
+    scheduler.submit(request(client))
+    assert scheduler.failures == 0
+    scheduler.submit(request(client))
+
+
+def test_critical_requests_go_first():
+    scheduler = Scheduler(1)
+    release = threading.Event()
+    order = []
+    holder = threading.Thread(target=scheduler.submit, args=(release.wait,))
+    holder.start()
+    while scheduler.active == 0:
+        time.sleep(0.001)
+    threads = []
+    for name, priority in [('background', Priority.BACKGROUND), ('normal', Priority.NORMAL), ('critical', Priority.CRITICAL)]:
+        thread = threading.Thread(target=scheduler.submit, args=(lambda name=name: order.append(name), priority))
+        thread.start()
+        threads.append(thread)
+        while len(scheduler._queue) < len(threads):
+            time.sleep(0.001)
+    release.set()
+    for thread in [holder, *threads]:
+        thread.join()
+    assert order == ['critical', 'normal', 'background']
@@ -0,0 +1,126 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from logs import setup_logging
+from main import Game
+
+FIELDS = ['game_id', 'seed', 'players', 'model', 'winner', 'rounds', 'calls', 'cached_calls', 'prompt_tokens', 'completion_tokens', 'wall_time', 'error',
+          'transcript']
+
+
+def init_worker():
+    # У каждого процесса свой файл лога: RotatingFileHandler нельзя делить между процессами
+    setup_logging(f'tournament-{os.getpid()}')
+
+
+def play_game(game_id: int, seed: int, players: int, model: str | None) -> dict:
+    # Выполняется в процессе-воркере. Клиент, пул соединений и кэш у каждого процесса свои (см. client.get_client).
+    started = time.perf_counter()
+    game = Game(players, seed=seed, humans=0, model=model, game_id=f'tournament-{game_id}-{seed}-{int(time.time())}')
+    error = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            game.start_game()
+        except Exception as e:
+            error = repr(e)
+            game.transcript.close(winner=game.winner, rounds=game.round, usage=game.total_usage(), error=error)
+    usage = game.total_usage()
+    return {
+        'game_id': game_id,
+        'seed': seed,
+        'players': players,
+        'model': game.model,
+        'winner': game.winner,
+        'rounds': game.round,
+        'calls': usage['calls'],
+        'cached_calls': usage['cached_calls'],
+        'prompt_tokens': usage['prompt_tokens'],
+        'completion_tokens': usage['completion_tokens'],
+        'wall_time': round(time.perf_counter() - started, 3),
+        'error': error,
+        'transcript': game.game_id,
+    }
+
+
+def load_results(path: str) -> dict[int, dict]:
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Последняя строка могла оборваться при падении турнира
+                continue
+            results[result['game_id']] = result
+    return results
+
+
+def print_summary(results: dict[int, dict]):
+    by_model = defaultdict(list)
+    for result in results.values():
+        by_model[result['model']].append(result)
+    for model, games in by_model.items():
+        finished = [game for game in games if game['error'] is None]
+        winners = Counter(game['winner'] for game in finished)
+        print(f'Модель {model}: игр {len(games)}, ошибок {len(games) - len(finished)}, победы {dict(winners)}')
+        if finished:
+            print(f'  в среднем: раундов {sum(g["rounds"] for g in finished) / len(finished):.2f}, '
+                  f'запросов {sum(g["calls"] for g in finished) / len(finished):.1f}, '
+                  f'токенов {sum(g["prompt_tokens"] + g["completion_tokens"] for g in finished) / len(finished):.0f}, '
+                  f'время {sum(g["wall_time"] for g in finished) / len(finished):.1f} с')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Турнир из игр, в которых играют только боты')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--model', action='append', help='можно указать несколько раз, игры распределяются по моделям по очереди')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='tournament.jsonl')
+    parser.add_argument('--csv', help='дополнительно писать результаты в CSV')
+    args = parser.parse_args()
+
+    models = args.model or [None]
+    results = load_results(args.out)
+    done = {game_id for game_id, result in results.items() if result['error'] is None}
+    pending = [game_id for game_id in range(args.games) if game_id not in done]
+    print(f'Игр сыграно: {len(done)}, осталось: {len(pending)}')
+
+    csv_file = None
+    writer = None
+    if args.csv:
+        new_csv = not os.path.exists(args.csv)
+        csv_file = open(args.csv, 'a', newline='', encoding='utf-8')
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+        if new_csv:
+            writer.writeheader()
+    with open(args.out, 'a', encoding='utf-8') as out, ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        futures = [
+            executor.submit(play_game, game_id, args.seed + game_id, args.players, models[game_id % len(models)])
+            for game_id in pending
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['game_id']] = result
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+            if writer is not None:
+                writer.writerow(result)
+                csv_file.flush()
+            print(f'Игра {result["game_id"]}: победили {result["winner"]}, раундов {result["rounds"]}, {result["wall_time"]} с'
+                  + (f', ошибка {result["error"]}' if result['error'] else ''))
+    if csv_file is not None:
+        csv_file.close()
+    print_summary(results)
+
+
+if __name__ == '__main__':
+    main()